@@ -0,0 +1,133 @@
+"""
+Hardware-free throughput benchmark for the lcdrw1063 driver.
+Runs standard workloads against the RW1063 emulator and reports, per frame, the i2c transactions,
+the bytes on the bus and the modeled bus time. Every frame is checked against the emulated screen.
+
+    python benchmark.py                         # Print the report
+    python benchmark.py --save baseline.json    # Store the results
+    python benchmark.py --baseline baseline.json  # Exit 1 when a workload got more expensive
+"""
+
+import argparse
+import json
+import sys
+
+import lcdrw1063 as LCD
+from rw1063emulator import EmulatorBus, RW1063Emulator, I2C_FREQUENCY
+
+FRAMES = 100
+
+# Horizontal progress bar glyphs from testHorizontalProgresBar.py, 0 to 5 columns filled.
+PROGRESS_GLYPHS = [["11111", "00000"] + [("1" * filled).ljust(5, "0")] * 4 + ["00000", "11111"]
+                   for filled in range(6)]
+
+# Spinner used by the custom character animation, a bar rotating over 4 phases.
+SPINNER_GLYPHS = [
+    ["00100", "00100", "00100", "00100", "00100", "00100", "00100", "00000"],
+    ["00001", "00010", "00010", "00100", "00100", "01000", "01000", "10000"],
+    ["00000", "00000", "00000", "11111", "00000", "00000", "00000", "00000"],
+    ["10000", "01000", "01000", "00100", "00100", "00010", "00010", "00001"],
+]
+
+
+def full_redraw(display, frame):
+    """ Every cell of the screen changes. """
+    character = "AB"[frame % 2]
+    for line in range(1, display.rows + 1):
+        display.lcd_frame_string(character * display.columns, line)
+    display.lcd_flush()
+
+
+def single_cell(display, frame):
+    """ One cell changes, a seconds counter digit. """
+    display.lcd_frame_string(str(frame % 10), 1, display.columns - 1)
+    display.lcd_flush()
+
+
+def progress_bar(display, frame):
+    """ The horizontal progress bar of testHorizontalProgresBar.py, one step per frame. """
+    if frame == 0:
+        custom = LCD.CustomCharacters(display)
+        (custom.char_1_data, custom.char_2_data, custom.char_3_data,
+         custom.char_4_data, custom.char_5_data, custom.char_6_data) = PROGRESS_GLYPHS
+        custom.load_custom_characters_data()
+    step = frame % 100
+    buffer = [5] * (step // 5) + [step % 5] + [0] * display.columns
+    display.lcd_frame_buffer(buffer[:display.columns], 1)
+    display.lcd_flush()
+
+
+def custom_char_animation(display, frame):
+    """ A spinner glyph redefined every frame next to the vertical level bars of testLcd.py moving on line 2. """
+    if frame == 0:
+        custom = LCD.CustomCharacters(display)
+        for level, char_data in enumerate([custom.char_1_data, custom.char_2_data, custom.char_3_data,
+                                           custom.char_4_data, custom.char_5_data, custom.char_6_data,
+                                           custom.char_7_data]):
+            display.glyphs.register(level, char_data)
+    display.glyphs.register("spinner", SPINNER_GLYPHS[frame % len(SPINNER_GLYPHS)])
+    codes = display.glyphs.codes(list(range(7)) + ["spinner"])
+    display.lcd_frame_buffer([codes[-1]], 1)
+    display.lcd_frame_buffer([codes[abs((frame + column) % 12 - 6)] for column in range(display.columns)], 2)
+    display.lcd_flush()
+
+
+WORKLOADS = [full_redraw, single_cell, progress_bar, custom_char_animation]
+
+
+def run(workload, frames=FRAMES, frequency=I2C_FREQUENCY):
+    """ Returns the per frame cost of a workload, initialization excluded. """
+    bus = EmulatorBus(frequency)
+    emulator = bus.attach(RW1063Emulator())
+    display = LCD.Lcd(transport=bus)
+    bus.reset_stats()
+    for frame in range(frames):
+        workload(display, frame)
+        if emulator.screen_codes() != [bytes(line) for line in display.frame]:
+            raise AssertionError("{}: frame {} is not on the emulated screen".format(workload.__name__, frame))
+    if emulator.busy_violations:
+        raise AssertionError("{}: {} bytes reached a busy controller".format(
+            workload.__name__, emulator.busy_violations))
+    return {
+        "transactions": bus.transactions / frames,
+        "bytes": bus.bytes / frames,
+        "bus_ms": bus.bus_time * 1000 / frames,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=FRAMES)
+    parser.add_argument("--frequency", type=int, default=I2C_FREQUENCY, help="i2c clock in Hz")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--save", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with the results stored in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="allowed relative increase")
+    args = parser.parse_args(argv)
+
+    results = {workload.__name__: run(workload, args.frames, args.frequency) for workload in WORKLOADS}
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{:<24}{:>14}{:>10}{:>10}{:>10}".format("workload", "transactions", "bytes", "bus ms", "max fps"))
+        for name, result in results.items():
+            print("{:<24}{:>14.2f}{:>10.1f}{:>10.3f}{:>10.0f}".format(
+                name, result["transactions"], result["bytes"], result["bus_ms"], 1000 / result["bus_ms"]))
+    if args.save:
+        with open(args.save, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = ["{} {}: {:.3f} -> {:.3f}".format(name, metric, baseline[name][metric], value)
+                       for name, result in results.items() if name in baseline
+                       for metric, value in result.items()
+                       if value > baseline[name][metric] * (1 + args.tolerance)]
+        for regression in regressions:
+            print("REGRESSION", regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
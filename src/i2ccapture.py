@@ -0,0 +1,305 @@
+"""
+Capture and replay of the i2c traffic of the lcdrw1063 driver.
+RecordingTransport sits between I2CDevice and the bus and appends every block write and combined
+transfer to a capture file; Capture reads one back through a memory map and replay sends it to a
+display or an emulator.
+
+    display = Lcd(transport=RecordingTransport("session.cap"))
+
+    python i2ccapture.py stats session.cap
+    python i2ccapture.py replay session.cap --bus 1           # Real display, original timing
+    python i2ccapture.py replay session.cap --emulator --max  # Emulated display, as fast as it takes
+
+Capture file: an 8 byte magic, then one record per i2c message: timestamp in nanoseconds since the
+recording transport was created, slave address, register (the first control byte, LCD_IR_*), flags,
+payload length and the payload. The messages of a combined transfer share the timestamp and all but
+the first are flagged CAPTURE_FLAG_CONTINUED. Records are only ever appended, recordings of several
+sessions can share a file.
+"""
+
+import argparse
+import sys
+from collections import namedtuple
+from mmap import mmap, ACCESS_READ
+from os import fstat
+from struct import Struct
+from threading import Lock
+from time import monotonic, sleep
+
+from lcdrw1063 import (SharedBus, I2CDevice, default_bus_number, instruction_execution_time,
+                       data_write_execution_time, LCD_IR_DATA_WRITE_OP, LCD_IR_CONTINUATION)
+
+CAPTURE_MAGIC = b"RW1063C1"
+CAPTURE_RECORD = Struct("<QBBBB")
+# The bus raised an error for this transaction, the display may not have received it.
+CAPTURE_FLAG_FAILED = 0b_0000_0001
+# The message went in the same combined transfer as the previous record.
+CAPTURE_FLAG_CONTINUED = 0b_0000_0010
+
+CaptureRecord = namedtuple("CaptureRecord", "timestamp addr register data failed continued")
+
+
+class RecordingTransport:
+    """
+    Transport that forwards to another one, by default the shared SMBus handle of busNumber, and
+    appends every block write and combined transfer to the capture file at path. Each transaction is
+    a single unbuffered write, a crash loses at most the one in flight.
+    """
+    def __init__(self, path, transport=None, busNumber=None):
+        self.shared = transport is None
+        if self.shared:
+            transport = SharedBus.acquire(default_bus_number() if busNumber is None else busNumber)
+        self.transport = transport
+        self.busNumber = getattr(transport, "busNumber", None)
+        # The driver schedules on the clock of the transport, the timestamps use the same clock.
+        self.clock = getattr(transport, "clock", monotonic)
+        self.sleep = getattr(transport, "sleep", sleep)
+        if hasattr(transport, "frequency"):
+            self.frequency = transport.frequency
+        self.lock = Lock()
+        self.file = open(path, "ab", buffering=0)
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+        self.start = self.clock()
+        self.records = 0
+
+    def write_i2c_block_data(self, addr, cmd, data):
+        """ Forwards a block write and records it, marked as failed when the bus raises OSError. """
+        with self.lock:
+            timestamp = round((self.clock() - self.start) * 1e9)
+            flags = 0
+            try:
+                self.transport.write_i2c_block_data(addr, cmd, data)
+            except OSError:
+                flags |= CAPTURE_FLAG_FAILED
+                raise
+            finally:
+                payload = bytes(data)
+                self.file.write(CAPTURE_RECORD.pack(timestamp, addr, cmd, flags, len(payload)) + payload)
+                self.records += 1
+
+    def write_i2c_messages(self, addr, messages):
+        """
+        Forwards a combined transfer and records its messages, marked as failed when the bus raises
+        OSError. A transport without combined transfers gets the messages as separate block writes.
+        """
+        if not hasattr(self.transport, "write_i2c_messages"):
+            for message in messages:
+                self.write_i2c_block_data(addr, message[0], list(message[1:]))
+            return
+        with self.lock:
+            timestamp = round((self.clock() - self.start) * 1e9)
+            flags = 0
+            try:
+                self.transport.write_i2c_messages(addr, messages)
+            except OSError:
+                flags |= CAPTURE_FLAG_FAILED
+                raise
+            finally:
+                records = bytearray()
+                for index, message in enumerate(messages):
+                    message = bytes(message)
+                    records += CAPTURE_RECORD.pack(timestamp, addr, message[0],
+                                                   flags | (CAPTURE_FLAG_CONTINUED if index else 0),
+                                                   len(message) - 1) + message[1:]
+                self.file.write(records)
+                self.records += len(messages)
+
+    def probe(self, addr):
+        """ Forwarded, probes are not recorded. """
+        return self.transport.probe(addr)
+
+    def release(self):
+        """ Closes the capture file and releases the bus when it was acquired here. """
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+            if self.shared:
+                self.shared = False
+                self.transport.release()
+
+
+class Capture:
+    """ Read-only view of a capture file through a memory map. Iterating yields CaptureRecord tuples. """
+    def __init__(self, path):
+        """ Maps the file as it is now, records appended later are not seen. Raises ValueError when it is not a capture. """
+        with open(path, "rb") as capture_file:
+            if fstat(capture_file.fileno()).st_size < len(CAPTURE_MAGIC):
+                raise ValueError("{} is not an i2c capture".format(path))
+            self.map = mmap(capture_file.fileno(), 0, access=ACCESS_READ)
+        if self.map[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self.map.close()
+            raise ValueError("{} is not an i2c capture".format(path))
+
+    def __iter__(self):
+        offset = len(CAPTURE_MAGIC)
+        size = len(self.map)
+        while offset + CAPTURE_RECORD.size <= size:
+            timestamp, addr, register, flags, length = CAPTURE_RECORD.unpack_from(self.map, offset)
+            offset += CAPTURE_RECORD.size
+            if offset + length > size:
+                # Truncated by a crash in the middle of a record.
+                return
+            yield CaptureRecord(timestamp, addr, register, self.map[offset:offset + length],
+                                bool(flags & CAPTURE_FLAG_FAILED), bool(flags & CAPTURE_FLAG_CONTINUED))
+            offset += length
+
+    def transfers(self):
+        """ Yields the records of every transaction as a list, several messages for a combined transfer. """
+        transfer = []
+        for record in self:
+            if transfer and not record.continued:
+                yield transfer
+                transfer = []
+            transfer.append(record)
+        if transfer:
+            yield transfer
+
+    def stats(self):
+        """ Returns transaction, message and byte counts, failures and the time span of the capture. """
+        stats = {"transactions": 0, "messages": 0, "bytes": 0, "instructions": 0, "data_bytes": 0, "failed": 0,
+                 "seconds": 0.0}
+        previous = None
+        for transfer in self.transfers():
+            stats["transactions"] += 1
+            stats["failed"] += transfer[0].failed
+            for record in transfer:
+                stats["messages"] += 1
+                # Control byte and payload, the address byte is not counted.
+                stats["bytes"] += 1 + len(record.data)
+                instructions, written = message_contents(record.register, record.data)
+                stats["instructions"] += len(instructions)
+                stats["data_bytes"] += written
+            timestamp = transfer[0].timestamp
+            if previous is not None and timestamp > previous:
+                stats["seconds"] += (timestamp - previous) / 1e9
+            previous = timestamp
+        return stats
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def message_contents(register, data):
+    """
+    Returns the instruction codes and the number of DDRAM/CGRAM data bytes of a recorded message.
+    A control byte with the Co bit is followed by a single byte, the last one by the rest of the message.
+    """
+    message = bytes([register]) + bytes(data)
+    instructions = []
+    written = 0
+    offset = 0
+    while offset < len(message):
+        control = message[offset]
+        end = offset + 2 if control & LCD_IR_CONTINUATION else len(message)
+        if control & LCD_IR_DATA_WRITE_OP:
+            written += len(message[offset + 1:end])
+        else:
+            instructions += message[offset + 1:end]
+        offset = end
+    return instructions, written
+
+def execution_time(register, data):
+    """ Returns how long the controller is busy after a recorded message, the longest of its instructions and data writes. """
+    instructions, written = message_contents(register, data)
+    times = [instruction_execution_time(command) for command in instructions]
+    if written:
+        times.append(data_write_execution_time())
+    return max(times, default=0.0)
+
+
+def replay(capture, transport, speed=1.0, addr=None):
+    """
+    Sends the successful transactions of capture to transport, an i2c transport such as SharedBus or
+    EmulatorBus, combined transfers again as one. speed scales the recorded timing, None sends as fast
+    as the controller accepts. Transactions still respect the execution times. addr redirects every
+    record to another address. Returns the number of transactions sent.
+    """
+    devices = {}
+    sent = 0
+    start = first = previous = None
+    for transfer in capture.transfers():
+        record = transfer[0]
+        if record.failed:
+            continue
+        target = record.addr if addr is None else addr
+        device = devices.get(target)
+        if device is None:
+            device = devices[target] = I2CDevice(addr=target, transport=transport)
+        scheduler = device.scheduler
+        if speed is not None:
+            if start is None or record.timestamp < previous:
+                # First record, or a new recording session appended to the file.
+                start, first = scheduler.clock(), record.timestamp
+            delay = start + (record.timestamp - first) / 1e9 / speed - scheduler.clock()
+            if delay > 0:
+                scheduler.sleep(delay)
+        previous = record.timestamp
+        device.begin()
+        try:
+            for message in transfer:
+                device.write_i2c_block_data(message.register, list(message.data),
+                                            execution_time(message.register, message.data))
+        finally:
+            device.commit()
+        sent += 1
+    return sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats_parser = commands.add_parser("stats", help="print the traffic in a capture")
+    stats_parser.add_argument("capture")
+    replay_parser = commands.add_parser("replay", help="send a capture to a display or the emulator")
+    replay_parser.add_argument("capture")
+    target = replay_parser.add_mutually_exclusive_group()
+    target.add_argument("--bus", type=int, help="i2c bus number, the default bus when omitted")
+    target.add_argument("--emulator", action="store_true", help="replay into the RW1063 emulator")
+    timing = replay_parser.add_mutually_exclusive_group()
+    timing.add_argument("--speed", type=float, default=1.0, help="timing scale, 2 replays twice as fast")
+    timing.add_argument("--max", action="store_true", help="ignore the recorded timing")
+    replay_parser.add_argument("--addr", type=lambda value: int(value, 0), help="send to this address instead")
+    args = parser.parse_args(argv)
+
+    with Capture(args.capture) as capture:
+        if args.command == "stats":
+            stats = capture.stats()
+            for name, value in stats.items():
+                print("{:<14}{:>12}".format(name, round(value, 3)))
+            if stats["seconds"]:
+                print("{:<14}{:>12.1f}".format("bytes/s", stats["bytes"] / stats["seconds"]))
+            return 0
+        speed = None if args.max else args.speed
+        if args.emulator:
+            from rw1063emulator import EmulatorBus, RW1063Emulator
+            bus = EmulatorBus()
+            emulators = {}
+            for record in capture:
+                target = record.addr if args.addr is None else args.addr
+                if target not in emulators:
+                    emulators[target] = bus.attach(RW1063Emulator(), target)
+            replay(capture, bus, speed, args.addr)
+            for target, emulator in sorted(emulators.items()):
+                print("{:#04x}:".format(target))
+                for line in emulator.screen():
+                    print("  |{}|".format(line))
+                if emulator.busy_violations:
+                    print("  {} bytes reached a busy controller".format(emulator.busy_violations))
+            return 0
+        bus = SharedBus.acquire(default_bus_number() if args.bus is None else args.bus)
+        try:
+            print(replay(capture, bus, speed, args.addr), "transactions sent")
+        finally:
+            bus.release()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
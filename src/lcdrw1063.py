@@ -5,24 +5,92 @@ character height transflective LCD display module from MIDAS Displays.
 http://www.rockworks.com.tw/homepage/html/RW1063.html
 """
 
-from smbus2 import SMBus
-from RPi.GPIO import RPI_REVISION
-from time import sleep
-from re import findall, match
-from subprocess import check_output
-from os.path import exists
-
-""" 
-Old and new versions of the RPi have swapped the two i2c buses
-they can be identified by RPI_REVISION (or check sysfs).
-"""
-BUS_NUMBER = 0 if RPI_REVISION == 1 else 1
+from smbus2 import SMBus, i2c_msg, I2cFunc
+from time import sleep, monotonic
+from os import environ, makedirs, replace
+from os.path import expanduser, join, dirname
+from threading import Lock, RLock, Condition, Thread, local
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from collections import OrderedDict
+from struct import Struct
+from array import array
 
 # Four 7-bit slave addresses (0111100, 0111101, 0111110 and 0111111) are reserved for the RW1063.
 LCD_ADDRESS_3C = 0b_0011_1100 # 0x3C
 LCD_ADDRESS_3D = 0b_0011_1101 # 0x3D
 LCD_ADDRESS_3E = 0b_0011_1110 # 0x3E
 LCD_ADDRESS_3F = 0b_0011_1111 # 0x3F
+LCD_ADDRESSES = (LCD_ADDRESS_3C, LCD_ADDRESS_3D, LCD_ADDRESS_3E, LCD_ADDRESS_3F)
+
+# Bus number and address found by autodetection are remembered here between runs.
+LCD_ADDRESS_CACHE = join(environ.get("XDG_CACHE_HOME") or expanduser("~/.cache"), "lcdrw1063", "addresses")
+
+@lru_cache(maxsize=None)
+def rpi_revision():
+    """
+    Returns the board revision the way RPi.GPIO.RPI_REVISION does (1, 2 or 3) without importing
+    RPi.GPIO, from the revision code in the device tree or /proc/cpuinfo. Unknown boards are 3.
+    """
+    code = None
+    try:
+        with open("/proc/device-tree/system/linux,revision", "rb") as revision:
+            code = int.from_bytes(revision.read(4), "big")
+    except (OSError, ValueError):
+        try:
+            with open("/proc/cpuinfo") as cpuinfo:
+                for line in cpuinfo:
+                    if line.startswith("Revision"):
+                        code = int(line.split(":")[1], 16)
+                        break
+        except (OSError, ValueError, IndexError):
+            pass
+    if code is None or code & (1 << 23):
+        # New style revision codes are used since the Pi 2 and B+.
+        return 3
+    code &= 0xFFFF
+    if code in (0x0002, 0x0003):
+        return 1
+    if code <= 0x000F:
+        return 2
+    return 3
+
+def default_bus_number():
+    """
+    Old and new versions of the RPi have swapped the two i2c buses
+    they can be identified by the board revision.
+    """
+    return 0 if rpi_revision() == 1 else 1
+
+def __getattr__(name):
+    """ BUS_NUMBER is resolved on first use so importing the module reads no board information. """
+    if name == "BUS_NUMBER":
+        return default_bus_number()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def _read_address_cache(path=None):
+    """ Returns the cached {bus number: address} mapping, empty when there is no readable cache. """
+    addresses = {}
+    try:
+        with open(path or LCD_ADDRESS_CACHE) as cache:
+            for line in cache:
+                busNumber, addr = line.split()
+                addresses[int(busNumber)] = int(addr, 16)
+    except (OSError, ValueError):
+        pass
+    return addresses
+
+def _write_address_cache(addresses, path=None):
+    """ Stores the {bus number: address} mapping. A cache that can not be written is not an error. """
+    path = path or LCD_ADDRESS_CACHE
+    try:
+        makedirs(dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as cache:
+            for busNumber, addr in sorted(addresses.items()):
+                cache.write("{} {:#04x}\n".format(busNumber, addr))
+        replace(path + ".tmp", path)
+    except OSError:
+        pass
 
 # 2 x 8 bit registers: DR - Data Register, IR - Instruction Register.
 # 8-bit Data Register, DR.
@@ -49,6 +117,12 @@ LCD_DISPLAY_CURSOR_OFF          = 0b_0000_00000
 LCD_DISPLAY_CURSOR_BLINK_ON     = 0b_0000_00001
 LCD_DISPLAY_CURSOR_BLINK_OFF    = 0b_0000_00000
 
+# Cursor or display shift.
+LCD_SHIFT_DISPLAY   = 0b_0000_1000
+LCD_SHIFT_CURSOR    = 0b_0000_0000
+LCD_SHIFT_RIGHT     = 0b_0000_0100
+LCD_SHIFT_LEFT      = 0b_0000_0000
+
 # Function set modes.
 # IF using IIC and 4-SPI interface DL bit must be setting to 1.
 LCD_FUNC_SET_DATA_LENGTH_8BIT   = 0b_0001_0000 
@@ -62,64 +136,934 @@ LCD_FUNC_SET_FONT_5x11          = 0b_0000_0100
 # RS|R/W , R/W always 0, only slave operation.
 LCD_IR_INSTRUCTION_WRITE_OP  = 0b_0000_0000 # 0x00
 LCD_IR_DATA_WRITE_OP         = 0b_0100_0000 # 0x40
+# Control byte Co bit: a single byte follows, then another control byte. Several instructions and a final
+# data or instruction write can share one i2c message this way.
+LCD_IR_CONTINUATION          = 0b_1000_0000 # 0x80
 
 # DDRAM line base addresses.
 LCD_LINE1_BASE_ADDRESS= 0x80 # 0000 0000 DDRAM Address 0x00
 LCD_LINE2_BASE_ADDRESS= 0xC0 # 0100 0000 DDRAM Address 0x40
 LCD_LINE3_BASE_ADDRESS= 0x94 # 0001 0100 DDRAM Address 0x14
 LCD_LINE4_BASE_ADDRESS= 0xD4 # 0101 0100 DDRAM Address 0x54
+LCD_LINE_BASE_ADDRESSES = (LCD_LINE1_BASE_ADDRESS, LCD_LINE2_BASE_ADDRESS,
+                           LCD_LINE3_BASE_ADDRESS, LCD_LINE4_BASE_ADDRESS)
 
-class I2CDevice:
-    """ Provides acces to the  I2C bus using the SMBus library."""
-    def __init__(self, addr=None, addr_default=LCD_ADDRESS_3C, busNumber=BUS_NUMBER):
-        """ Sets the I2C device address and I2C bus number. If not informed tries to find it 
-        assuming there is only one display attached to the I2C bus."""
-        if not addr:
-            # try autodetect address, else use default if provided.
+# Instruction execution times from the RW1063 datasheet instruction table, fOSC = 540 kHz.
+LCD_EXEC_TIME_SLOW = 0.76e-3  # Clear display, return home.
+LCD_EXEC_TIME_FAST = 18.5e-6  # Every other instruction and each DDRAM/CGRAM data write.
+LCD_INSTRUCTION_EXEC_TIMES = {
+    LCD_DR_CLEAR_DISPLAY        : LCD_EXEC_TIME_SLOW,
+    LCD_DR_RETURN_HOME          : LCD_EXEC_TIME_SLOW,
+    LCD_DR_ENTRY_MODE_SET       : LCD_EXEC_TIME_FAST,
+    LCD_DR_DISPLAY_ON_OFF       : LCD_EXEC_TIME_FAST,
+    LCD_DR_CURSOR_DISPLAY_SHIFT : LCD_EXEC_TIME_FAST,
+    LCD_DR_FUNCTION_SET         : LCD_EXEC_TIME_FAST,
+    LCD_DR_SET_CGRAM_ADDRESS    : LCD_EXEC_TIME_FAST,
+    LCD_DR_SET_DDRAM_ADDRESS    : LCD_EXEC_TIME_FAST,
+}
+LCD_EXEC_TIME_DATA_WRITE = LCD_EXEC_TIME_FAST
+# Execution times scale with 1/fOSC, and fOSC may be as low as 380 kHz.
+LCD_FOSC_TYPICAL = 540_000
+LCD_FOSC_MIN     = 380_000
+# A transaction reaches the controller only after its address and control bytes, 2 x 9 bit times:
+# 45 us at the 400 kHz fast mode clock. Shorter busy times need no wait at all.
+LCD_I2C_FAST_MODE = 400_000
+LCD_I2C_LEAD_TIME = 2 * 9 / LCD_I2C_FAST_MODE
+
+def instruction_execution_time(command, fosc=LCD_FOSC_MIN):
+    """
+    Returns the time in seconds the controller needs to execute an instruction code.
+    The instruction is identified by its highest set bit. Defaults to the slowest oscillator.
+    """
+    if command <= 0:
+        return 0.0
+    instruction = 1 << (command.bit_length() - 1)
+    return LCD_INSTRUCTION_EXEC_TIMES[instruction] * LCD_FOSC_TYPICAL / fosc
+
+def data_write_execution_time(fosc=LCD_FOSC_MIN):
+    """ Returns the time in seconds the controller needs to store the last byte of a data write. """
+    return LCD_EXEC_TIME_DATA_WRITE * LCD_FOSC_TYPICAL / fosc
+
+
+class DeadlineScheduler:
+    """
+    Holds the next transaction back only while the controller is still executing the previous one.
+    The RW1063 busy flag can not be read over i2c, so the deadline comes from the execution time table.
+    """
+    def __init__(self, clock=monotonic, sleep=sleep, lead=LCD_I2C_LEAD_TIME):
+        self.clock = clock
+        self.sleep = sleep
+        self.lead = lead
+        self.ready_at = 0.0
+
+    def wait(self):
+        """ Sleeps until the controller is ready to accept the next transaction. Returns the seconds slept. """
+        remaining = self.ready_at - self.lead - self.clock()
+        if remaining > 0:
+            self.sleep(remaining)
+            return remaining
+        return 0.0
+
+    def busy_for(self, seconds):
+        """ Records that the controller is busy for seconds from now. """
+        self.ready_at = max(self.ready_at, self.clock() + seconds)
+
+# Display geometry of the MC42005A6W-SPTLYI-V2, 20 columns x 4 rows.
+LCD_COLUMNS = 20
+LCD_ROWS = 4
+# DDRAM size, 7-bit address space. Cleared DDRAM holds "20H" (space code).
+LCD_DDRAM_SIZE = 0x80
+LCD_SPACE_CODE = 0x20
+# 2-line display mode: two 40 byte DDRAM lines, "00H" - "27H" and "40H" - "67H".
+# The address counter runs from the end of one line into the start of the other.
+LCD_DDRAM_LINE_LENGTH = 0x28
+LCD_DDRAM_LINE1_ADDRESS = 0x00
+LCD_DDRAM_LINE2_ADDRESS = 0x40
+# 1-line display mode: a single 80 byte DDRAM line, "00H" - "4FH".
+LCD_DDRAM_ONE_LINE_LENGTH = 0x50
+# SMBus block writes carry at most 32 data bytes.
+LCD_I2C_BLOCK_MAX = 32
+# CGRAM holds 8 custom characters of 8 rows, 5x8 font. Character n is at CGRAM address 8 * n.
+LCD_CGRAM_SIZE = 0x40
+LCD_CGRAM_CHARACTERS = 8
+LCD_CGRAM_CHARACTER_SIZE = 8
+# Up to this many clean cells between two dirty runs are resent instead of
+# issuing a new DDRAM address set, which costs a whole i2c transaction.
+LCD_FLUSH_MAX_GAP = 2
+# After a failed write the controller is re-initialized and its state restored, retrying up to
+# LCD_RECOVERY_ATTEMPTS times with a delay doubling from LCD_RECOVERY_FIRST_DELAY up to LCD_RECOVERY_MAX_DELAY.
+LCD_RECOVERY_ATTEMPTS = 8
+LCD_RECOVERY_FIRST_DELAY = 1e-3
+LCD_RECOVERY_MAX_DELAY = 50e-3
+
+
+class LcdGeometry:
+    """
+    Panel layout: columns x rows, the DDRAM address of the first cell of every row, the display line
+    mode (N) and the font (F). In 2-line mode rows 1 and 2 start the two DDRAM lines and rows 3 and 4
+    continue them right after the visible columns, like on 20x4 modules. The 5x11 font needs 1-line mode.
+    """
+    def __init__(self, columns, rows, rowAddresses=None, twoLine=None, font5x11=False):
+        self.columns = columns
+        self.rows = rows
+        self.two_line = rows > 1 if twoLine is None else twoLine
+        self.font_5x11 = font5x11
+        if rowAddresses is None:
+            rowAddresses = ((LCD_DDRAM_LINE1_ADDRESS, LCD_DDRAM_LINE2_ADDRESS,
+                             LCD_DDRAM_LINE1_ADDRESS + columns, LCD_DDRAM_LINE2_ADDRESS + columns)
+                            if self.two_line else (LCD_DDRAM_LINE1_ADDRESS,))
+        self.row_addresses = tuple(address & 0x7F for address in rowAddresses[:rows])
+        self.line_length = LCD_DDRAM_LINE_LENGTH if self.two_line else LCD_DDRAM_ONE_LINE_LENGTH
+        if len(self.row_addresses) != rows:
+            raise ValueError("{} rows need {} row addresses".format(rows, rows))
+        if font5x11 and self.two_line:
+            raise ValueError("the 5x11 font needs 1-line display mode")
+        if any(self.line_start(address) + self.line_length < address + columns for address in self.row_addresses):
+            raise ValueError("{} columns do not fit in a DDRAM line".format(columns))
+
+    def line_start(self, address):
+        """ Returns the address of the DDRAM line holding address. """
+        if self.two_line and address >= LCD_DDRAM_LINE2_ADDRESS:
+            return LCD_DDRAM_LINE2_ADDRESS
+        return LCD_DDRAM_LINE1_ADDRESS
+
+    def function_set(self):
+        """ Returns the function set instruction for this geometry, 8-bit interface. """
+        return (LCD_DR_FUNCTION_SET | LCD_FUNC_SET_DATA_LENGTH_8BIT
+                | (LCD_FUNC_SET_TWO_LINE_NUMBER if self.two_line else LCD_FUNC_SET_ONE_LINE_NUMBER)
+                | (LCD_FUNC_SET_FONT_5x11 if self.font_5x11 else LCD_FUNC_SET_FONT_5x8))
+
+# Common character modules.
+LCD_GEOMETRY_16x1 = LcdGeometry(16, 1)
+LCD_GEOMETRY_16x1_5x11 = LcdGeometry(16, 1, font5x11=True)
+LCD_GEOMETRY_20x1 = LcdGeometry(20, 1)
+LCD_GEOMETRY_16x2 = LcdGeometry(16, 2)
+LCD_GEOMETRY_20x2 = LcdGeometry(20, 2)
+LCD_GEOMETRY_40x2 = LcdGeometry(40, 2)
+LCD_GEOMETRY_16x4 = LcdGeometry(16, 4)
+LCD_GEOMETRY_20x4 = LcdGeometry(LCD_COLUMNS, LCD_ROWS, LCD_LINE_BASE_ADDRESSES)
+
+def clip_to_row(buffer, column, columns):
+    """
+    Returns (column, data): the bytes of buffer that land on a row of columns cells when written from
+    column on, and the column the first of them goes to. Bytes before the first or after the last cell are dropped.
+    """
+    skip = max(0, -column)
+    return column + skip, bytes(buffer[skip:max(0, columns - column)])
+
+class SharedBus:
+    """
+    Long-lived SMBus handle shared by every I2CDevice on the same bus number.
+    Get it with SharedBus.acquire and give it back with release; the handle is closed
+    when its last user releases it. Writes are serialized by a per-bus lock.
+    """
+    _buses = {}
+    _buses_lock = Lock()
+
+    @classmethod
+    def acquire(cls, busNumber):
+        """ Returns the shared bus for busNumber, creating it on first use, and counts a new user. """
+        with cls._buses_lock:
+            shared = cls._buses.get(busNumber)
+            if shared is None:
+                shared = cls._buses[busNumber] = cls(busNumber)
+            shared.users += 1
+            return shared
+
+    def __init__(self, busNumber):
+        self.busNumber = busNumber
+        self.lock = RLock()
+        self.bus = None
+        self.users = 0
+
+    def release(self):
+        """ Drops a user. The last one closes the handle and forgets the bus. """
+        with SharedBus._buses_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            if SharedBus._buses.get(self.busNumber) is self:
+                del SharedBus._buses[self.busNumber]
+        self.close()
+
+    def open(self):
+        """ Opens /dev/i2c-N unless it is already open. """
+        with self.lock:
+            if self.bus is None:
+                self.bus = SMBus(self.busNumber)
+
+    def close(self):
+        """ Closes /dev/i2c-N. The next write opens it again. """
+        with self.lock:
+            if self.bus is not None:
+                bus, self.bus = self.bus, None
+                bus.close()
+
+    def write_i2c_block_data(self, addr, cmd, data):
+        """
+        Sends i2c block data to addr holding the bus lock. On error the handle is closed,
+        so the next write starts with a freshly opened bus, and the error is raised.
+        """
+        with self.lock:
+            self.open()
             try:
-                self.addr = int('0x{}'.format(
-                    findall("[0-9a-z]{2}(?!:)", \
-                    check_output(['/usr/sbin/i2cdetect', '-y', str(BUS_NUMBER)]).decode())[0]), base=16) \
-                    if exists('/usr/sbin/i2cdetect') else addr_default
-            except:
-                self.addr = addr_default
+                self.bus.write_i2c_block_data(addr, cmd, data)
+            except OSError:
+                self.close()
+                raise
+
+    def write_i2c_messages(self, addr, messages):
+        """
+        Sends several write messages to addr in one combined transfer, a single i2c_rdwr kernel call,
+        when the adapter supports plain i2c. Otherwise every message goes in its own block write,
+        its first byte as the command. Error handling as in write_i2c_block_data.
+        """
+        with self.lock:
+            self.open()
+            try:
+                if self.bus.funcs & I2cFunc.I2C:
+                    self.bus.i2c_rdwr(*[i2c_msg.write(addr, message) for message in messages])
+                else:
+                    for message in messages:
+                        self.bus.write_i2c_block_data(addr, message[0], list(message[1:]))
+            except OSError:
+                self.close()
+                raise
+
+    def probe(self, addr):
+        """ Returns True if a device acknowledges addr, using a quick write like i2cdetect does for 0x3C-0x3F. """
+        with self.lock:
+            self.open()
+            try:
+                self.bus.write_quick(addr)
+                return True
+            except OSError:
+                return False
+
+
+def find_lcd_address(bus, addr_default=LCD_ADDRESS_3C):
+    """
+    Returns the address of the RW1063 on the shared bus. The address cached by the previous run is
+    checked first with a single probe, otherwise the four reserved addresses are probed in order
+    and the first one answering is cached. Falls back to addr_default when none answers.
+    Transports without a bus number, like emulated buses, are not cached.
+    """
+    cacheable = getattr(bus, "busNumber", None) is not None
+    addresses = _read_address_cache() if cacheable else {}
+    cached = addresses.get(bus.busNumber) if cacheable else None
+    if cached is not None and bus.probe(cached):
+        return cached
+    for addr in LCD_ADDRESSES:
+        if addr != cached and bus.probe(addr):
+            if cacheable:
+                addresses[bus.busNumber] = addr
+                _write_address_cache(addresses)
+            return addr
+    return addr_default
+
+
+class Histogram:
+    """ Latency histogram with power of two microsecond buckets: <= 1 us, <= 2 us, <= 4 us, ... """
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        """ Adds a sample in seconds. """
+        bound = 1
+        while bound < seconds * 1e6:
+            bound <<= 1
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def snapshot(self):
+        """ Returns count, total, min and max in seconds and the buckets as {upper bound in us: samples}. """
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "buckets_us": dict(sorted(self.buckets.items()))}
+
+
+class Metrics:
+    """
+    Opt-in instrumentation shared by an Lcd and its I2CDevice. Counts calls, i2c transactions and
+    bytes per public Lcd method (nested calls are charged to the outermost one, queued writes to the
+    method that queued them, not to the commit sending them), and keeps latency
+    histograms of bus writes, scheduler sleeps and the time between flushed frames.
+    hook, when given, is called as hook(event, value, method) for every sample, with event one of
+    "bus_write", "sleep", "frame_interval" or "dropped_frames".
+    """
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.lock = Lock()
+        self.scope = local()
+        self.methods = {}
+        self.histograms = {"bus_write": Histogram(), "sleep": Histogram(), "frame_interval": Histogram()}
+        self.frames = 0
+        self.dropped_frames = 0
+        self.last_frame = None
+
+    @contextmanager
+    def call(self, method):
+        """ Charges everything done inside to method, unless an outer public method already is. """
+        if getattr(self.scope, "method", None) is not None:
+            yield
+            return
+        self.scope.method = method
+        with self.lock:
+            self._counters(method)["calls"] += 1
+        try:
+            yield
+        finally:
+            self.scope.method = None
+
+    def transaction(self, owners, seconds):
+        """
+        Records an i2c write which took seconds, owners maps the methods that queued its writes, None
+        outside any, to their bytes after the address byte. The transaction is counted for the method
+        owning most bytes.
+        """
+        method = max(owners, key=owners.get) or "i2c"
+        with self.lock:
+            for owner, length in owners.items():
+                self._counters(owner or "i2c")["bytes"] += length
+            self._counters(method)["transactions"] += 1
+            self.histograms["bus_write"].observe(seconds)
+        self._emit("bus_write", seconds, method)
+
+    def owner(self):
+        """ Returns the public method the current writes are charged to, None outside any. """
+        return getattr(self.scope, "method", None)
+
+    def slept(self, seconds):
+        """ Records a scheduler sleep. """
+        with self.lock:
+            self.histograms["sleep"].observe(seconds)
+        self._emit("sleep", seconds, getattr(self.scope, "method", None))
+
+    def frame(self, now):
+        """ Records a flushed frame at time now. """
+        with self.lock:
+            self.frames += 1
+            interval = None if self.last_frame is None else now - self.last_frame
+            self.last_frame = now
+            if interval is not None:
+                self.histograms["frame_interval"].observe(interval)
+        if interval is not None:
+            self._emit("frame_interval", interval, getattr(self.scope, "method", None))
+
+    def dropped(self, frames):
+        """ Records frames that were coalesced and never drawn. """
+        with self.lock:
+            self.dropped_frames += frames
+        self._emit("dropped_frames", frames, None)
+
+    def snapshot(self):
+        """ Returns a copy of every counter and histogram as plain dicts. """
+        with self.lock:
+            return {
+                "methods": {method: dict(counters) for method, counters in self.methods.items()},
+                "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+                "frames": self.frames,
+                "dropped_frames": self.dropped_frames,
+            }
+
+    def _counters(self, method):
+        counters = self.methods.get(method)
+        if counters is None:
+            counters = self.methods[method] = {"calls": 0, "transactions": 0, "bytes": 0}
+        return counters
+
+    def _emit(self, event, value, method):
+        if self.hook is not None:
+            self.hook(event, value, method)
+
+
+def _instrumented(method):
+    """
+    Marks a public Lcd method whose bus traffic is charged to it when metrics are on. Only an Lcd
+    created with metrics gets the wrappers, see _metered, the others call the method directly.
+    """
+    method.instrumented = True
+    return method
+
+def _metered(metrics, name, method):
+    """ Returns bound method wrapped so everything it does is charged to name in metrics. """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with metrics.call(name):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class I2CDevice:
+    """
+    Provides acces to the  I2C bus using the SMBus library.
+    Another transport, like the emulated bus in rw1063emulator, can be plugged in instead. A transport
+    provides write_i2c_block_data(addr, cmd, data), probe(addr) and release(), and optionally its own
+    clock() and sleep(seconds) for the execution time scheduler, its i2c clock frequency in Hz and
+    write_i2c_messages(addr, messages) for combined transfers.
+    Writes made between begin and commit are queued and sent together, see commit.
+    """
+    def __init__(self, addr=None, addr_default=LCD_ADDRESS_3C, busNumber=None, transport=None, metrics=None):
+        """ Sets the I2C device address and I2C bus number. If not informed they are found on first use,
+        assuming there is only one display attached to the I2C bus. metrics is an optional Metrics."""
+        self._addr = addr
+        self.metrics = metrics
+        self.addr_default = addr_default
+        self.transport = transport
+        if transport is not None:
+            self.busNumber = getattr(transport, "busNumber", None)
         else:
-            self.addr = addr
-        self.busNumber = busNumber
+            self.busNumber = default_bus_number() if busNumber is None else busNumber
+        self.bus = None
+        # Writes queued between begin and commit, (cmd, data, executionTime).
+        self.queue = []
+        self.batch_depth = 0
+        # Lead time from the i2c clock, no slower than fast mode since the real bus speed is unknown.
+        frequency = max(getattr(transport, "frequency", LCD_I2C_FAST_MODE), LCD_I2C_FAST_MODE)
+        self.scheduler = DeadlineScheduler(getattr(transport, "clock", monotonic),
+                                           getattr(transport, "sleep", sleep),
+                                           2 * 9 / frequency)
+        self.open()
+
+    @property
+    def addr(self):
+        """ Device address, autodetected on first use when it was not informed. """
+        if not self._addr:
+            self.open()
+            self._addr = find_lcd_address(self.bus, self.addr_default)
+        return self._addr
+
+    @addr.setter
+    def addr(self, addr):
+        self._addr = addr
+
+    def open(self):
+        """ Attaches the device to the shared handle of its bus, or to its transport. """
+        if self.bus is None:
+            self.bus = self.transport if self.transport is not None else SharedBus.acquire(self.busNumber)
+
+    def close(self):
+        """ Detaches the device from its bus. The bus is closed when no device uses it. """
+        if self.bus is not None:
+            bus, self.bus = self.bus, None
+            if bus is not self.transport:
+                bus.release()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
     
-    def write_i2c_block_data(self, cmd, data):
-        """ Safe sends i2c block data. Up to 32 bytes. """
-        with SMBus(self.busNumber) as bus:
-            bus.write_i2c_block_data(self.addr, cmd, data)
-        sleep(0.0001)
+    def write_i2c_block_data(self, cmd, data, executionTime=0.0):
+        """
+        Safe sends i2c block data, split in blocks of up to 32 bytes. Waits first if the device is still
+        executing the previous transaction, then marks it busy for executionTime seconds.
+        Between begin and commit the write is queued instead, with the method it is charged to.
+        """
+        owner = None if self.metrics is None else self.metrics.owner()
+        self.queue.append((cmd, bytes(data), executionTime, owner))
+        if not self.batch_depth:
+            self._send_queue()
+
+    def begin(self):
+        """ Starts queueing writes. Calls nest, the outermost commit sends the queue. """
+        self.batch_depth += 1
+
+    def commit(self):
+        """
+        Sends the queued writes in as few transfers as possible. Instructions are chained in front of
+        the next write of the same message with the control byte Co bit, messages carry up to 32 bytes
+        after their first control byte and go together in one combined transfer. A write executing
+        longer than the next byte takes to arrive, clear display and return home, ends the transfer.
+        """
+        self.batch_depth -= 1
+        if not self.batch_depth:
+            self._send_queue()
+
+    def _send_queue(self):
+        """ Sends and empties the queue, waiting between the transfers for the controller. """
+        queue, self.queue = self.queue, []
+        for messages, executionTime, owners in self._transfers(queue):
+            self.open()
+            waited = self.scheduler.wait()
+            if waited and self.metrics is not None:
+                self.metrics.slept(waited)
+            start = self.scheduler.clock()
+            if len(messages) == 1:
+                self.bus.write_i2c_block_data(self.addr, messages[0][0], list(messages[0][1:]))
+            elif hasattr(self.bus, "write_i2c_messages"):
+                self.bus.write_i2c_messages(self.addr, messages)
+            else:
+                for message in messages:
+                    self.bus.write_i2c_block_data(self.addr, message[0], list(message[1:]))
+            if self.metrics is not None:
+                self.metrics.transaction(owners, self.scheduler.clock() - start)
+            self.scheduler.busy_for(executionTime)
+
+    def _transfers(self, queue):
+        """
+        Returns the queued writes as a list of (messages, execution time of the last write, owners)
+        transfers, owners maps the methods charged with the writes to their bytes in the transfer.
+        """
+        transfers = []
+        messages = []
+        message = bytearray()
+        owners = {}
+        for cmd, data, executionTime, owner in queue:
+            if cmd == LCD_IR_INSTRUCTION_WRITE_OP:
+                owners[owner] = owners.get(owner, 0) + 2 * len(data)
+                for command in data:
+                    if len(message) + 2 > LCD_I2C_BLOCK_MAX + 1:
+                        messages.append(_end_message(message))
+                        message = bytearray()
+                    message += bytes([LCD_IR_CONTINUATION | cmd, command])
+            else:
+                while True:
+                    if len(message) + 2 > LCD_I2C_BLOCK_MAX + 1:
+                        messages.append(_end_message(message))
+                        message = bytearray()
+                    room = LCD_I2C_BLOCK_MAX - len(message)
+                    # The data write runs to the end of the message.
+                    message.append(cmd)
+                    message += data[:room]
+                    owners[owner] = owners.get(owner, 0) + 1 + len(data[:room])
+                    data = data[room:]
+                    messages.append(bytes(message))
+                    message = bytearray()
+                    if not data:
+                        break
+            if executionTime > self.scheduler.lead:
+                if message:
+                    messages.append(_end_message(message))
+                    message = bytearray()
+                transfers.append((messages, executionTime, owners))
+                messages = []
+                owners = {}
+        if message:
+            messages.append(_end_message(message))
+        if messages:
+            transfers.append((messages, queue[-1][2], owners))
+        return transfers
+
+
+def _end_message(message):
+    """ Returns a message of chained instructions with the Co bit cleared in its last control byte. """
+    message[-2] &= ~LCD_IR_CONTINUATION
+    return bytes(message)
+
+
+# Character generator ROM, HD44780 compatible A00 (Japanese) table. ASCII from 20H to 7DH except 5CH.
+LCD_ROM_A00 = {chr(code): code for code in range(0x20, 0x7E) if code != 0x5C}
+LCD_ROM_A00.update({
+    "¥": 0x5C, "→": 0x7E, "←": 0x7F,
+    "°": 0xDF, "α": 0xE0, "ä": 0xE1, "β": 0xE2, "ε": 0xE3, "μ": 0xE4,
+    "µ": 0xE4, "σ": 0xE5, "ρ": 0xE6, "√": 0xE8, "¢": 0xEC, "ñ": 0xEE,
+    "ö": 0xEF, "θ": 0xF2, "∞": 0xF3, "Ω": 0xF4, "Ω": 0xF4, "ü": 0xF5,
+    "Σ": 0xF6, "π": 0xF7, "千": 0xFA, "万": 0xFB, "円": 0xFC, "÷": 0xFD,
+    "█": 0xFF,
+})
+# Half-width katakana and punctuation, U+FF61 to U+FF9F, are A1H to DFH.
+LCD_ROM_A00.update({chr(0xFF61 + offset): 0xA1 + offset for offset in range(0x3F)})
+
+# Bitmaps for common characters the ROM lacks, loaded into CGRAM on demand.
+LCD_FALLBACK_GLYPHS = {
+    "\\": ["00000", "10000", "01000", "00100", "00010", "00001", "00000", "00000"],
+    "~": ["00000", "00000", "01000", "10101", "00010", "00000", "00000", "00000"],
+    "à": ["01000", "00100", "01110", "00001", "01111", "10001", "01111", "00000"],
+    "â": ["00100", "01010", "01110", "00001", "01111", "10001", "01111", "00000"],
+    "å": ["00100", "01010", "00100", "01110", "00001", "01111", "10001", "01111"],
+    "ç": ["00000", "01110", "10000", "10000", "10001", "01110", "00100", "01100"],
+    "è": ["01000", "00100", "01110", "10001", "11111", "10000", "01110", "00000"],
+    "é": ["00010", "00100", "01110", "10001", "11111", "10000", "01110", "00000"],
+    "ê": ["00100", "01010", "01110", "10001", "11111", "10000", "01110", "00000"],
+    "î": ["00100", "01010", "00000", "01100", "00100", "00100", "01110", "00000"],
+    "ô": ["00100", "01010", "01110", "10001", "10001", "10001", "01110", "00000"],
+    "ø": ["00000", "00001", "01110", "10011", "10101", "11001", "01110", "10000"],
+    "ù": ["01000", "00100", "10001", "10001", "10001", "10011", "01101", "00000"],
+    "ß": ["01100", "10010", "10010", "10110", "10001", "10001", "10110", "00000"],
+    "Ä": ["01010", "00000", "01110", "10001", "11111", "10001", "10001", "00000"],
+    "Å": ["00100", "01010", "00100", "01110", "10001", "11111", "10001", "00000"],
+    "É": ["00010", "00100", "11111", "10000", "11110", "10000", "11111", "00000"],
+    "Ñ": ["01101", "10010", "10001", "11001", "10101", "10011", "10001", "00000"],
+    "Ö": ["01010", "00000", "01110", "10001", "10001", "10001", "01110", "00000"],
+    "Ü": ["01010", "00000", "10001", "10001", "10001", "10001", "01110", "00000"],
+    "¡": ["00100", "00000", "00100", "00100", "00100", "00100", "00100", "00000"],
+    "¿": ["00100", "00000", "00100", "01000", "10000", "10001", "01110", "00000"],
+    "€": ["00110", "01001", "11100", "01000", "11100", "01001", "00110", "00000"],
+}
+
+LCD_UNKNOWN_CODE = 0x3F # "?"
+
+
+class CharacterEncoder:
+    """
+    Translates Unicode text to character codes of the RW1063 character generator ROM.
+    Translations are memoized, repeated labels cost a dictionary lookup. A character missing from
+    the ROM uses its CGRAM glyph from LCD_FALLBACK_GLYPHS when the encoder has a GlyphBank, else the
+    ROM code of its base letter ("é" shows "e") or "?".
+    """
+    def __init__(self, glyphs=None, table=LCD_ROM_A00, fallbackGlyphs=LCD_FALLBACK_GLYPHS, cacheSize=1024):
+        self.glyphs = glyphs
+        self.table = table
+        self.fallback_glyphs = fallbackGlyphs
+        if glyphs is not None:
+            for character, bitmap in fallbackGlyphs.items():
+                glyphs.register(("char", character), bitmap)
+        self._translate = lru_cache(maxsize=cacheSize)(self._translate_string)
+
+    def encode(self, string):
+        """ Returns the character codes of string, loading the CGRAM glyphs it needs. """
+        plain, names, positions = self._translate(string)
+        if not names or self.glyphs is None:
+            return plain
+        codes = self.glyphs.codes(names)
+        data = bytearray(plain)
+        for position, index in positions:
+            data[position] = codes[index]
+        return bytes(data)
+
+    def rom_encode(self, string):
+        """ Returns the character codes of string using the ROM only, safe to call from any thread. """
+        return self._translate(string)[0]
+
+    def _translate_string(self, string):
+        """
+        Returns the ROM translation of string, the glyph names it needs (no more than fit in CGRAM)
+        and (position, glyph index) pairs telling where their codes go.
+        """
+        data = bytearray()
+        names = []
+        positions = []
+        slots = self.glyphs.characters if self.glyphs is not None else 0
+        for character in string:
+            code = self.table.get(character)
+            if code is None:
+                code = self._base_code(character)
+                name = ("char", character)
+                if character in self.fallback_glyphs and (name in names or len(names) < slots):
+                    if name not in names:
+                        names.append(name)
+                    positions.append((len(data), names.index(name)))
+            data.append(code)
+        return bytes(data), tuple(names), tuple(positions)
+
+    def _base_code(self, character):
+        """ Returns the ROM code of the base letter of an accented character, or the "?" code. """
+        from unicodedata import normalize
+        for base in normalize("NFKD", character):
+            code = self.table.get(base)
+            if code is not None:
+                return code
+        return LCD_UNKNOWN_CODE
 
 
 class Lcd:
     """Lcd driver for I2C RW1063 LCD controllers."""
-    def __init__(self, addr=None):
-        """Inits driver and sets initial display configuration."""
+    def __init__(self, addr=None, busNumber=None, transport=None, metrics=None, geometry=LCD_GEOMETRY_20x4):
+        """
+        Inits driver and sets initial display configuration. transport replaces the i2c bus, see I2CDevice.
+        metrics, a Metrics instance, turns on per method counters and latency histograms.
+        geometry, an LcdGeometry such as LCD_GEOMETRY_16x2, describes the panel.
+        """
         self.addr = addr
-        self.i2c = I2CDevice(addr=self.addr, addr_default=LCD_ADDRESS_3C)
+        self.metrics = metrics
+        if metrics is not None:
+            for name in dir(type(self)):
+                if getattr(getattr(type(self), name), "instrumented", False):
+                    setattr(self, name, _metered(metrics, name, getattr(self, name)))
+        self.i2c = I2CDevice(addr=self.addr, addr_default=LCD_ADDRESS_3C, busNumber=busNumber,
+                             transport=transport, metrics=metrics)
+        self.geometry = geometry
+        self.columns = geometry.columns
+        self.rows = geometry.rows
+        # DDRAM address of the first cell of every row, 0x80 set address bit stripped.
+        self.row_addresses = list(geometry.row_addresses)
+        # Shadow of the controller DDRAM, what the panel is showing right now.
+        self.ddram = bytearray([LCD_SPACE_CODE] * LCD_DDRAM_SIZE)
+        # Next frame, rows x columns character codes, sent by lcd_flush.
+        self.frame = [bytearray([LCD_SPACE_CODE] * self.columns) for _ in range(self.rows)]
+        # Display shift in cells, positive when the display was shifted to the left.
+        self.display_shift = 0
+        self._map_cells()
+        # DDRAM address held in the address counter, None while unknown or pointing to CGRAM.
+        self.address_counter = None
+        # CGRAM address held in the address counter, None while it points to DDRAM.
+        self.cgram_address_counter = None
+        # Shadow of the CGRAM contents written by this driver.
+        self.cgram = bytearray(LCD_CGRAM_SIZE)
+        self.entry_mode = LCD_ENTRY_MODE_RIGHT | LCD_ENTRY_SHIFT_OFF
+        # Last display on/off instruction sent.
+        self.display_control = LCD_DR_DISPLAY_ON_OFF | LCD_DISPLAY_OFF
+        # Custom characters written by this driver, restored after a controller reset.
+        self.cgram_written = set()
+        # Failed writes are retried this many times after restoring the controller state, 0 turns recovery off.
+        self.recovery_attempts = LCD_RECOVERY_ATTEMPTS
+        self.recoveries = 0
+        self.recovering = False
+        self.batch_state = None
+        # Custom characters shared by the widgets and the CGRAM fallback of the encoder.
+        self.glyphs = GlyphBank(self)
+        # Unicode to character ROM translation, set CharacterEncoder(self.glyphs) for CGRAM fallback.
+        self.encoder = CharacterEncoder()
         self.lcd_init_function_set()
         self.lcd_set_display_on()
         self.lcd_clear_display()
-        self.lcd_entry_mode_set_left_shift_off()
-        sleep(0.2)
+        self.lcd_entry_mode_set_right_shift_off()
+
+    def close(self):
+        """ Releases the i2c bus. The display keeps showing its contents. """
+        self.i2c.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @_instrumented
+    def lcd_i2c_send_block_data(self, instructionRegister, data, executionTime=0.0):
+        """
+        Sends data block to the display by the i2c bus. The display is busy executionTime seconds afterwards.
+        When the write fails the controller is recovered, see lcd_recover, and the block sent again.
+        """
+        try:
+            self.i2c.write_i2c_block_data(instructionRegister, data, executionTime)
+        except OSError:
+            if self.recovering or not self.recovery_attempts:
+                raise
+            self.lcd_recover()
+            self.i2c.write_i2c_block_data(instructionRegister, data, executionTime)
+
+    @_instrumented
+    def lcd_begin(self):
+        """ Starts queueing the writes to the display, see lcd_commit. Calls nest. """
+        if not self.i2c.batch_depth and not self.recovering:
+            # Driver state before the queued writes, put back when they are lost, see lcd_commit.
+            self.batch_state = self._state()
+        self.i2c.begin()
+
+    @_instrumented
+    def lcd_commit(self):
+        """
+        Sends the writes queued since lcd_begin in as few i2c transfers as possible: a full 20x4 screen
+        goes in one combined transfer instead of 8 block writes. When the transfer fails, the driver
+        state already holds the queued writes, recovering the controller completes them. Without a
+        recovery, the driver state is put back as it was at lcd_begin: the frame cells and custom
+        characters of the lost writes stay pending and the next flush sends them again.
+        """
+        try:
+            self.i2c.commit()
+        except OSError:
+            if self.recovering or self.i2c.batch_depth:
+                raise
+            try:
+                if not self.recovery_attempts:
+                    raise
+                self.lcd_recover()
+            except OSError:
+                self._rollback(self.batch_state, frame=False)
+                raise
+
+    @contextmanager
+    def lcd_batch(self):
+        """ Context manager queueing the writes of its block and sending them together at the end. """
+        self.lcd_begin()
+        try:
+            yield self
+        finally:
+            self.lcd_commit()
+
+    @_instrumented
+    def lcd_recover(self):
+        """
+        Re-initializes the controller, after a power cycle or a bus error, and restores from the driver
+        state: function set, display on/off, DDRAM contents, custom characters, display shift, entry mode
+        and address counter. Retries with a doubling delay, raises the last OSError when every attempt fails
+        and leaves the driver state as it was before.
+        """
+        state = self._state()
+        delay = LCD_RECOVERY_FIRST_DELAY
+        self.recovering = True
+        try:
+            for attempt in range(self.recovery_attempts):
+                self.i2c.scheduler.sleep(delay)
+                try:
+                    self._restore(*state)
+                    self.recoveries += 1
+                    return
+                except OSError:
+                    if attempt == self.recovery_attempts - 1:
+                        self._rollback(state)
+                        raise
+                    delay = min(2 * delay, LCD_RECOVERY_MAX_DELAY)
+        finally:
+            self.recovering = False
+
+    def _state(self):
+        """ Returns a copy of the driver state, see _restore and _rollback. """
+        return (bytes(self.ddram), bytes(self.cgram), sorted(self.cgram_written), self.display_control,
+                self.display_shift, self.entry_mode, self.address_counter, self.cgram_address_counter,
+                [bytes(line) for line in self.frame])
+
+    def _rollback(self, state, frame=True):
+        """
+        Puts back the driver state of _state without sending anything, after writes to the controller
+        were lost. The address counter becomes unknown, the frame is kept when frame is False.
+        """
+        ddram, cgram, cgramWritten, displayControl, displayShift, entryMode, _, _, lines = state
+        self.ddram[:] = ddram
+        self.cgram[:] = cgram
+        self.cgram_written.clear()
+        self.cgram_written.update(cgramWritten)
+        self.display_control = displayControl
+        self.entry_mode = entryMode
+        self.address_counter = None
+        self.cgram_address_counter = None
+        if displayShift != self.display_shift:
+            self.display_shift = displayShift
+            self._map_cells()
+        if frame:
+            for row, line in zip(self.frame, lines):
+                row[:] = line
 
+    def _restore(self, ddram, cgram, cgramWritten, displayControl, displayShift, entryMode,
+                 addressCounter, cgramAddressCounter, frame):
+        """
+        Brings a freshly reset controller to the given state with the fewest transactions, and puts
+        back the frame with the cells not flushed yet.
+        """
+        with self.lcd_batch():
+            self._restore_state(ddram, cgram, cgramWritten, displayControl, displayShift, entryMode,
+                                addressCounter, cgramAddressCounter)
+        for row, line in zip(self.frame, frame):
+            row[:] = line
 
-    def lcd_i2c_send_block_data(self, instructionRegister, data):
-        """ Sends data block to the display by the i2c bus. """
-        self.i2c.write_i2c_block_data(instructionRegister, data)
+    def _restore_state(self, ddram, cgram, cgramWritten, displayControl, displayShift, entryMode,
+                       addressCounter, cgramAddressCounter):
+        """ Sends the instructions and data of _restore. """
+        self.lcd_init_function_set()
+        self.lcd_send_instruction_write_command(displayControl)
+        self.display_control = displayControl
+        self.lcd_clear_display()
+        self.lcd_entry_mode_set(LCD_ENTRY_MODE_RIGHT | LCD_ENTRY_SHIFT_OFF)
+        # Clear display left spaces everywhere, only the rest is written.
+        address = LCD_DDRAM_LINE1_ADDRESS
+        run = []
+        gap = 0
+        for _ in range(LCD_DDRAM_ONE_LINE_LENGTH):
+            if ddram[address] != LCD_SPACE_CODE:
+                run.append(address)
+                gap = 0
+            elif run:
+                gap += 1
+                if gap > LCD_FLUSH_MAX_GAP:
+                    self._restore_run(ddram, run)
+                    run = []
+            address = self._next_ddram_address(address)
+        if run:
+            self._restore_run(ddram, run)
+        codes = cgramWritten
+        index = 0
+        while index < len(codes):
+            first = index
+            while index + 1 < len(codes) and codes[index + 1] == codes[index] + 1:
+                index += 1
+            index += 1
+            self.lcd_write_custom_characters(codes[first], [
+                cgram[code * LCD_CGRAM_CHARACTER_SIZE:(code + 1) * LCD_CGRAM_CHARACTER_SIZE]
+                for code in codes[first:index]])
+        # Shift the display in the direction needing fewer instructions.
+        line_length = self.geometry.line_length
+        shift = displayShift % line_length
+        mode = LCD_SHIFT_DISPLAY | (LCD_SHIFT_LEFT if shift <= line_length // 2 else LCD_SHIFT_RIGHT)
+        for _ in range(min(shift, line_length - shift)):
+            self.lcd_cursor_display_shift(mode)
+        self.lcd_entry_mode_set(entryMode)
+        if cgramAddressCounter is not None:
+            self.lcd_set_cgram_address(cgramAddressCounter)
+        elif addressCounter is not None:
+            self._move_address_counter(addressCounter)
 
+    def _restore_run(self, ddram, run):
+        """ Writes the DDRAM cells from the first to the last address of run, in address counter order. """
+        data = []
+        address = run[0]
+        while True:
+            data.append(ddram[address])
+            if address == run[-1]:
+                break
+            address = self._next_ddram_address(address)
+        self.lcd_write_ddram(run[0], data)
+
+    @_instrumented
     def lcd_send_instruction_write_command(self, command) :
         """ Sends an instruction write command to the display by the i2c bus """
-        self.lcd_i2c_send_block_data(LCD_IR_INSTRUCTION_WRITE_OP, [command])
+        self.lcd_i2c_send_block_data(LCD_IR_INSTRUCTION_WRITE_OP, [command],
+                                     instruction_execution_time(command))
         
+    @_instrumented
     def lcd_send_data_write_command(self, buffer) :
         """ Sends a data write command to the display by the i2c bus. """
-        self.lcd_i2c_send_block_data(LCD_IR_DATA_WRITE_OP, buffer)
+        self.lcd_i2c_send_block_data(LCD_IR_DATA_WRITE_OP, buffer, data_write_execution_time())
+        if self.address_counter is not None:
+            self.address_counter = self._update_ddram(self.address_counter, buffer)
+            if self.entry_mode & LCD_ENTRY_SHIFT_ON:
+                # I/D = 1 shifts the display to the left after every write, I/D = 0 to the right.
+                self.display_shift += self._entry_step() * len(buffer)
+                self._map_cells()
+        elif self.cgram_address_counter is not None:
+            self.cgram_address_counter = self._update_cgram(self.cgram_address_counter, buffer)
         
 
+    @_instrumented
     def lcd_clear_display(self):
         """
         Clear all the display data by writing "20H" (space code) to all DDRAM address, and set DDRAM
@@ -127,14 +1071,29 @@ class Lcd:
         the cursor to the left edge on first line of the display. Make entry mode increment (I/D = "1").
         """    
         self.lcd_send_instruction_write_command(LCD_DR_CLEAR_DISPLAY)
+        self.address_counter = LCD_DDRAM_LINE1_ADDRESS
+        self.cgram_address_counter = None
+        self.entry_mode |= LCD_ENTRY_MODE_RIGHT
+        self.ddram[:] = bytes([LCD_SPACE_CODE]) * LCD_DDRAM_SIZE
+        for row in self.frame:
+            row[:] = bytes([LCD_SPACE_CODE]) * self.columns
+        self.display_shift = 0
+        self._map_cells()
         
+    @_instrumented
     def lcd_return_home(self):
         """
         Return Home is cursor return home instruction. Set DDRAM address to "00H" into the address counter. Return 
         cursor to its original site and return display to its original status, if shifted. A content of DDRAM does not change. 
         """
         self.lcd_send_instruction_write_command(LCD_DR_RETURN_HOME)
+        self.address_counter = LCD_DDRAM_LINE1_ADDRESS
+        self.cgram_address_counter = None
+        if self.display_shift:
+            self.display_shift = 0
+            self._map_cells()
 
+    @_instrumented
     def lcd_entry_mode_set(self, mode) :
         """
         Sets the moving direction of cursor and display. 
@@ -148,24 +1107,60 @@ class Lcd:
         shift left, I/D = "0”: shift right). 
         """
         self.lcd_send_instruction_write_command(LCD_DR_ENTRY_MODE_SET | mode)
+        self.entry_mode = mode
         
+    @_instrumented
     def lcd_entry_mode_set_left_shift_on(self) :
         """ Shift all the display to the left, cursor moves according to the display. """
         self.lcd_entry_mode_set(LCD_ENTRY_MODE_LEFT | LCD_ENTRY_SHIFT_ON)
         
+    @_instrumented
     def lcd_entry_mode_set_left_shift_off(self) :
         """ Shift cursor to the left, address counter is decreased by 1. """
         self.lcd_entry_mode_set(LCD_ENTRY_MODE_LEFT | LCD_ENTRY_SHIFT_OFF)
         
+    @_instrumented
     def lcd_entry_mode_set_right_shift_on(self) :
         """ Shift all the display to the right, cursor moves according to the display. """
         self.lcd_entry_mode_set(LCD_ENTRY_MODE_RIGHT | LCD_ENTRY_SHIFT_ON)
         
+    @_instrumented
     def lcd_entry_mode_set_right_shift_off(self) :
         """ Shift cursor to the right, address counter is increased by 1. """
         self.lcd_entry_mode_set(LCD_ENTRY_MODE_RIGHT | LCD_ENTRY_SHIFT_OFF)
         
 
+    @_instrumented
+    def lcd_cursor_display_shift(self, mode) :
+        """
+        Moves the cursor or shifts the display by one position without writing or reading display data.
+        LCD_SHIFT_DISPLAY | LCD_SHIFT_LEFT / LCD_SHIFT_RIGHT shifts the entire display: every DDRAM line
+        scrolls, and the address counter does not change.
+        LCD_SHIFT_CURSOR | LCD_SHIFT_LEFT / LCD_SHIFT_RIGHT moves the cursor, the address counter is
+        decreased / increased by 1. A CGRAM address is set again before the next CGRAM write.
+        """
+        self.lcd_send_instruction_write_command(LCD_DR_CURSOR_DISPLAY_SHIFT | mode)
+        step = 1 if mode & LCD_SHIFT_RIGHT else -1
+        if mode & LCD_SHIFT_DISPLAY:
+            self.display_shift -= step
+            self._map_cells()
+        elif self.address_counter is not None:
+            self.address_counter = self._next_ddram_address(self.address_counter, step)
+        else:
+            # The datasheet does not tell where a cursor shift leaves a CGRAM address, forget it.
+            self.cgram_address_counter = None
+
+    @_instrumented
+    def lcd_shift_display_left(self) :
+        """ Shifts the entire display one position to the left. """
+        self.lcd_cursor_display_shift(LCD_SHIFT_DISPLAY | LCD_SHIFT_LEFT)
+
+    @_instrumented
+    def lcd_shift_display_right(self) :
+        """ Shifts the entire display one position to the right. """
+        self.lcd_cursor_display_shift(LCD_SHIFT_DISPLAY | LCD_SHIFT_RIGHT)
+
+    @_instrumented
     def lcd_set_display_on(self, cursorOn = False, cursorBlinkOn = False) :
         """
         Entire display is turned on:
@@ -186,21 +1181,28 @@ class Lcd:
             command = command | LCD_DISPLAY_CURSOR_BLINK_ON
             
         self.lcd_send_instruction_write_command( command)
+        self.display_control = command
         
+    @_instrumented
     def lcd_set_display_off(self) :
         """ Display is turned off, but display data is remained in DDRAM. """
         self.lcd_send_instruction_write_command(LCD_DR_DISPLAY_ON_OFF | LCD_DISPLAY_OFF )    
+        self.display_control = LCD_DR_DISPLAY_ON_OFF | LCD_DISPLAY_OFF
         
+    @_instrumented
     def lcd_init_function_set(self) :
-        """ Sets Default Configuration: 8bit, 2 Lines per controller, 5x8 Font size. """        
-        command = LCD_DR_FUNCTION_SET | LCD_FUNC_SET_DATA_LENGTH_8BIT | LCD_FUNC_SET_TWO_LINE_NUMBER | LCD_FUNC_SET_FONT_5x8
-        self.lcd_send_instruction_write_command( command)
+        """ Sets the configuration of the geometry: 8bit, 1 or 2 Lines per controller, 5x8 or 5x11 Font size. """        
+        self.lcd_send_instruction_write_command(self.geometry.function_set())
                 
         
+    @_instrumented
     def lcd_set_cgram_address(self, sixBitAddress) :
         """ Sets CGRAM address to AC. This instruction makes CGRAM data available from MPU. """
         self.lcd_send_instruction_write_command(LCD_DR_SET_CGRAM_ADDRESS | sixBitAddress )
+        self.address_counter = None
+        self.cgram_address_counter = sixBitAddress & 0x3F
         
+    @_instrumented
     def lcd_set_ddram_address(self, sevenBitAddress) :
         """
         Sets DDRAM address to AC. This instruction makes DDRAM data available from MPU.
@@ -209,7 +1211,10 @@ class Lcd:
         and DDRAM address in the 2nd line is from "40H" - "67H".
         """
         self.lcd_send_instruction_write_command(LCD_DR_SET_DDRAM_ADDRESS | sevenBitAddress)
+        self.address_counter = sevenBitAddress & 0x7F
+        self.cgram_address_counter = None
         
+    @_instrumented
     def lcd_write_ram_data(self, eightBitData):
         """
         Writes binary 8-bit data to DDRAM/CGRAM. 
@@ -218,41 +1223,573 @@ class Lcd:
         After write operation, the address is automatically increased/decreased by 1, according to the entry mode. 
         """
         self.lcd_send_data_write_command([eightBitData & 0b_1111_1111])        
+
+    @_instrumented
+    def lcd_write_custom_characters(self, firstCode, glyphs):
+        """
+        Writes the 8 byte bitmaps in glyphs to the custom characters firstCode, firstCode + 1, ...
+        They are contiguous in CGRAM, so one CGRAM address set is followed by the data, in one batch.
+        """
+        data = b"".join(bytes(glyph) for glyph in glyphs)
+        if not data:
+            return
+        address = firstCode * LCD_CGRAM_CHARACTER_SIZE
+        with self.lcd_batch():
+            if self.cgram_address_counter != address:
+                self.lcd_set_cgram_address(address)
+            self.lcd_send_data_write_command(data)
         
        
+    @_instrumented
+    def lcd_write_ddram(self, address, buffer):
+        """
+        Writes buffer to DDRAM from address on, in one batch. The DDRAM address is set only when the
+        address counter is elsewhere.
+        """
+        with self.lcd_batch():
+            self._move_address_counter(address & 0x7F)
+            self.lcd_send_data_write_command(buffer)
+
+    @_instrumented
     def lcd_display_string(self, string, line):
         """ Displays String in predefined lines, 1 to 4. Maximum Length 32 chars, depending on display. """
-        if line == 1:
-            self.lcd_set_ddram_address(LCD_LINE1_BASE_ADDRESS)
-        if line == 2:
-            self.lcd_set_ddram_address(LCD_LINE2_BASE_ADDRESS)
-        if line == 3:
-            self.lcd_set_ddram_address(LCD_LINE3_BASE_ADDRESS)
-        if line == 4:
-            self.lcd_set_ddram_address(LCD_LINE4_BASE_ADDRESS)
-        
-        self.lcd_send_data_write_command( string.encode())
+        self.lcd_display_buffer(self.encoder.encode(string), line)
         
+    @_instrumented
     def lcd_display_buffer(self, buffer, line):
-        """ Display byte buffer in predefined lines, 1 to 4. Maximum Length 32 bytes buffer, depending on display. """
-        if line == 1:
-            self.lcd_set_ddram_address(LCD_LINE1_BASE_ADDRESS)
-        if line == 2:
-            self.lcd_set_ddram_address(LCD_LINE2_BASE_ADDRESS)
-        if line == 3:
-            self.lcd_set_ddram_address(LCD_LINE3_BASE_ADDRESS)
-        if line == 4:
-            self.lcd_set_ddram_address(LCD_LINE4_BASE_ADDRESS)
-        sleep(.01)
-        self.lcd_send_data_write_command(buffer)
+        """ Display byte buffer in predefined lines, 1 to 4. Bytes beyond the last column are dropped. """
+        self.lcd_write_at(line, 0, buffer)
+
+    @_instrumented
+    def lcd_write_at(self, line, column, buffer):
+        """
+        Writes byte buffer, or String, to the cells of line, 1 to 4, from column on. Bytes that would
+        land off-screen, before the first or after the last column or on a missing line, are not sent.
+        Cells consecutive in DDRAM go in one data write, all of them in one batch.
+        """
+        if isinstance(buffer, str):
+            buffer = self.encoder.encode(buffer)
+        if not 1 <= line <= self.rows:
+            return
+        addresses = self.cell_addresses[line - 1]
+        cells = [(addresses[column + index], value) for index, value in enumerate(buffer)
+                 if 0 <= column + index < self.columns]
+        step = self._entry_step()
+        if step < 0:
+            cells.reverse()
+        index = 0
+        with self.lcd_batch():
+            while index < len(cells):
+                start = index
+                index += 1
+                while (index < len(cells)
+                       and cells[index][0] == self._next_ddram_address(cells[index - 1][0], step)):
+                    index += 1
+                self._move_address_counter(cells[start][0])
+                self.lcd_send_data_write_command(bytes(value for _, value in cells[start:index]))
     
+    @_instrumented
+    def lcd_frame_string(self, string, line, column=0):
+        """
+        Writes String into the next frame at line, 1 to 4, starting at column. Nothing is sent
+        to the display until lcd_flush. Characters beyond the last column are dropped.
+        """
+        self.lcd_frame_buffer(self.encoder.encode(string), line, column)
+
+    @_instrumented
+    def lcd_frame_buffer(self, buffer, line, column=0):
+        """
+        Writes byte buffer into the next frame at line, 1 to 4, starting at column. Nothing is sent
+        to the display until lcd_flush. Bytes that would land off-screen, before the first or after
+        the last column or on a missing line, are dropped.
+        """
+        if not 1 <= line <= self.rows:
+            return
+        column, data = clip_to_row(buffer, column, self.columns)
+        self.frame[line - 1][column:column + len(data)] = data
+
+    @_instrumented
+    def lcd_flush(self, maxRuns=None):
+        """
+        Sends the cells of the frame that changed since they were last sent to the display.
+        Dirty runs are merged when they are adjacent in DDRAM, like the end of line 1 and the start of
+        line 3, and sent in bursts of up to 32 bytes, all in one batch. The DDRAM address is only set
+        when the address counter is not already there. Expects entry mode without display shift.
+        With maxRuns only that many runs are sent. Returns True when the display shows the whole frame.
+        """
+        runs = list(self._dirty_runs())
+        if self._entry_step() < 0:
+            runs = [(end, start, data[::-1]) for start, end, data in reversed(runs)]
+        complete = maxRuns is None or len(runs) <= maxRuns
+        with self.lcd_batch():
+            for start, _, data in runs[:maxRuns]:
+                self._move_address_counter(start)
+                self.lcd_send_data_write_command(data)
+        if complete and self.metrics is not None:
+            self.metrics.frame(self.i2c.scheduler.clock())
+        return complete
+
+    def _move_address_counter(self, address):
+        """ Sets the DDRAM address unless the address counter already holds it. """
+        if self.address_counter != address:
+            self.lcd_set_ddram_address(address)
+
+    def _entry_step(self):
+        """ Returns +1 when the address counter increments after a data write, -1 when it decrements. """
+        return 1 if self.entry_mode & LCD_ENTRY_MODE_RIGHT else -1
+
+    def _next_ddram_address(self, address, step=1):
+        """ Returns the address the address counter moves to from address, in the display line mode. """
+        if not self.geometry.two_line:
+            return (address + step) % LCD_DDRAM_ONE_LINE_LENGTH
+        line_start = self.geometry.line_start(address)
+        other_start = LCD_DDRAM_LINE1_ADDRESS if line_start else LCD_DDRAM_LINE2_ADDRESS
+        offset = address - line_start + step
+        if offset >= LCD_DDRAM_LINE_LENGTH:
+            return other_start
+        if offset < 0:
+            return other_start + LCD_DDRAM_LINE_LENGTH - 1
+        return line_start + offset
+
+    def _map_cells(self):
+        """
+        Maps every visible cell to the DDRAM address it shows under the current display shift, and
+        reloads the frame with what those addresses hold. Cells written to the frame and not flushed yet
+        keep their pending value.
+        """
+        line_length = self.geometry.line_length
+        self.display_shift %= line_length
+        pending = {(row, column) for address, (row, column) in getattr(self, "cells", {}).items()
+                   if self.frame[row][column] != self.ddram[address]}
+        # DDRAM address -> (row, column) of every visible cell, and the reverse lookup by row and column.
+        self.cells = {}
+        self.cell_addresses = []
+        for row, base in enumerate(self.row_addresses):
+            line_start = self.geometry.line_start(base)
+            addresses = [line_start + (base - line_start + column + self.display_shift) % line_length
+                         for column in range(self.columns)]
+            self.cell_addresses.append(addresses)
+            for column, address in enumerate(addresses):
+                self.cells[address] = (row, column)
+                if (row, column) not in pending:
+                    self.frame[row][column] = self.ddram[address]
+        # Visible cells grouped in runs the address counter walks through without an address set.
+        self.cell_sequences = self._cell_sequences()
+
+    def _cell_sequences(self):
+        """
+        Walks the whole DDRAM in address counter order from "00H" and returns the visible cells
+        as lists of (address, row, column), one list per stretch of consecutive visible addresses.
+        """
+        sequences = [[]]
+        address = LCD_DDRAM_LINE1_ADDRESS
+        for _ in range(LCD_DDRAM_ONE_LINE_LENGTH):
+            if address in self.cells:
+                sequences[-1].append((address,) + self.cells[address])
+            elif sequences[-1]:
+                sequences.append([])
+            address = self._next_ddram_address(address)
+        return [sequence for sequence in sequences if sequence]
+
+    def _dirty_runs(self):
+        """
+        Yields (first address, last address, data) for every run of frame cells that differ from the
+        DDRAM shadow, in address counter order, bridging short clean gaps, up to 32 bytes each.
+        """
+        for sequence in self.cell_sequences:
+            dirty = [self.frame[row][column] != self.ddram[address] for address, row, column in sequence]
+            index = 0
+            while index < len(sequence):
+                if not dirty[index]:
+                    index += 1
+                    continue
+                start = end = index
+                index += 1
+                while (index < len(sequence) and index - end <= LCD_FLUSH_MAX_GAP + 1
+                       and index - start < LCD_I2C_BLOCK_MAX):
+                    if dirty[index]:
+                        end = index
+                    index += 1
+                yield (sequence[start][0], sequence[end][0],
+                       bytes(self.frame[row][column] for _, row, column in sequence[start:end + 1]))
+                index = end + 1
+
+    def custom_character(self, code):
+        """ Returns the 8 byte bitmap the driver last wrote to custom character code, None while unknown. """
+        if code not in self.cgram_written:
+            return None
+        return bytes(self.cgram[code * LCD_CGRAM_CHARACTER_SIZE:(code + 1) * LCD_CGRAM_CHARACTER_SIZE])
+
+    def _update_cgram(self, address, data):
+        """ Records data written from address on in the CGRAM shadow and returns where the address counter ends. """
+        step = self._entry_step()
+        for value in data:
+            self.cgram[address] = value
+            self.cgram_written.add(address // LCD_CGRAM_CHARACTER_SIZE)
+            address = (address + step) % LCD_CGRAM_SIZE
+        return address
+
+    def _update_ddram(self, address, data):
+        """
+        Records data written from address on in the DDRAM shadow, keeps the frame in step with it
+        and returns the address the address counter ends at.
+        """
+        step = self._entry_step()
+        for value in data:
+            self.ddram[address] = value
+            cell = self.cells.get(address)
+            if cell is not None:
+                self.frame[cell[0]][cell[1]] = value
+            address = self._next_ddram_address(address, step)
+        return address
     
+    @_instrumented
     def lcd_clear(self):
         """ Clears the lcd and sets cursor to home. """
         self.lcd_clear_display()
         self.lcd_return_home()
         
 
+class LcdRenderer:
+    """
+    Non-blocking front end for Lcd. Callers write into a frame and return at once, a worker thread
+    sends the newest frame to the display at up to maxFps frames per second. Frames written while
+    the worker is busy or waiting for its next slot are coalesced: only the latest state is drawn.
+    """
+    def __init__(self, lcd, maxFps=30):
+        """ Starts the worker thread. The renderer owns lcd from now on, do not write to it directly. """
+        self.lcd = lcd
+        self.period = 1.0 / maxFps
+        self.frame = [bytearray(line) for line in lcd.frame]
+        self.condition = Condition()
+        # Every finished write is a new frame generation.
+        self.generation = 0
+        self.rendered = 0
+        self.dropped_frames = 0
+        self.error = None
+        self.waiters = []
+        self.depth = 0
+        self.running = True
+        self.thread = Thread(target=self._run, name="lcd-renderer", daemon=True)
+        self.thread.start()
+
+    def lcd_display_string(self, string, line):
+        """ Writes String at the start of line, 1 to 4. Returns without waiting for the display. """
+        self.lcd_frame_buffer(self.lcd.encoder.rom_encode(string), line)
+
+    def lcd_display_buffer(self, buffer, line):
+        """ Writes byte buffer at the start of line, 1 to 4. Returns without waiting for the display. """
+        self.lcd_frame_buffer(buffer, line)
+
+    def lcd_frame_string(self, string, line, column=0):
+        """ Writes String into the frame at line, 1 to 4, starting at column. """
+        self.lcd_frame_buffer(self.lcd.encoder.rom_encode(string), line, column)
+
+    def lcd_frame_buffer(self, buffer, line, column=0):
+        """ Writes byte buffer into the frame at line, 1 to 4, starting at column. Off-screen bytes are dropped. """
+        with self.frame_update():
+            if 1 <= line <= len(self.frame):
+                column, data = clip_to_row(buffer, column, len(self.frame[line - 1]))
+                self.frame[line - 1][column:column + len(data)] = data
+
+    @contextmanager
+    def frame_update(self):
+        """ Groups several writes into one frame, the worker never draws half of it. """
+        with self.condition:
+            self.depth += 1
+            try:
+                yield self.frame
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.generation += 1
+                    self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ Blocks until every frame written so far is on the display. Returns False on timeout. """
+        with self.condition:
+            target = self.generation
+            return self.condition.wait_for(lambda: self.rendered >= target or not self.running, timeout)
+
+    async def flush_async(self):
+        """ Awaitable flush, suspends the calling coroutine instead of blocking the event loop. """
+        from asyncio import get_running_loop
+        loop = get_running_loop()
+        future = loop.create_future()
+        with self.condition:
+            if self.rendered >= self.generation or not self.running:
+                return
+            waiter = (self.generation, loop, future)
+            self.waiters.append(waiter)
+        try:
+            await future
+        finally:
+            # A cancelled or timed out wait is forgotten, its loop may be closed by now.
+            with self.condition:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+
+    def close(self, timeout=None):
+        """ Draws the pending frame, stops the worker thread and closes the display. """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        self.lcd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        """ Worker loop: waits for a new generation and its frame slot, then flushes the newest frame. """
+        next_slot = 0.0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.generation != self.rendered or not self.running)
+                if self.generation == self.rendered:
+                    break
+            delay = next_slot - monotonic()
+            if delay > 0 and self.running:
+                sleep(delay)
+            next_slot = monotonic() + self.period
+            with self.condition:
+                generation = self.generation
+                for row, line in zip(self.lcd.frame, self.frame):
+                    row[:] = line
+            try:
+                self.lcd.lcd_flush()
+            except OSError as error:
+                # Keep the frame pending, it is sent again in the next slot.
+                self.error = error
+                if not self.running:
+                    break
+                continue
+            with self.condition:
+                self.error = None
+                self.dropped_frames += generation - self.rendered - 1
+                if self.lcd.metrics is not None and generation - self.rendered > 1:
+                    self.lcd.metrics.dropped(generation - self.rendered - 1)
+                self.rendered = generation
+                self.condition.notify_all()
+                self._wake_waiters()
+        with self.condition:
+            self._wake_waiters(everyone=True)
+
+    def _wake_waiters(self, everyone=False):
+        """ Resolves the flush_async futures whose frame is on the display. """
+        pending = []
+        for generation, loop, future in self.waiters:
+            if everyone or generation <= self.rendered:
+                try:
+                    loop.call_soon_threadsafe(_resolve_future, future)
+                except RuntimeError:
+                    # The event loop is closed, nobody is waiting any more.
+                    pass
+            else:
+                pending.append((generation, loop, future))
+        self.waiters = pending
+
+
+def _resolve_future(future):
+    """ Completes an asyncio future unless its coroutine was cancelled. """
+    if not future.done():
+        future.set_result(None)
+
+
+class Marquee:
+    """
+    Ticker text scrolled by the controller with the display shift instruction. The text is loaded
+    once into the DDRAM line of line, 40 bytes in 2-line mode and 80 in 1-line mode, then every step
+    costs a single shift instruction.
+    Text longer than the DDRAM line is fed in at the edge, one byte per step, right before it
+    scrolls into view.
+    The display shift moves the whole display: on 4 row modules rows 1 and 3 (and rows 2 and 4)
+    share a DDRAM line and show a single 40 character window, the other line scrolls along.
+    """
+    def __init__(self, lcd, text, line=1, gap="   "):
+        """ Loads text followed by gap, when it wraps around, into the DDRAM line of line, 1 to 4. """
+        self.lcd = lcd
+        self.line_start = lcd.geometry.line_start(lcd.row_addresses[line - 1])
+        self.line_length = lcd.geometry.line_length
+        # Visible cells of the DDRAM line, the window that scrolls over the text.
+        self.window = sum(1 for address in lcd.cells
+                          if self.line_start <= address < self.line_start + self.line_length)
+        self.text = lcd.encoder.encode(text + gap if len(text) > self.window else text)
+        self.text = self.text.ljust(max(self.line_length, len(self.text)))
+        self.position = 0
+        lcd.lcd_return_home()
+        lcd.lcd_write_ddram(self.line_start, self.text[:self.line_length])
+
+    def step(self):
+        """ Scrolls the text one character to the left. """
+        self.position += 1
+        # The cell scrolling into view at the right edge of the window.
+        offset = (self.position + self.window - 1) % self.line_length
+        value = self.text[(self.position + self.window - 1) % len(self.text)]
+        if self.lcd.ddram[self.line_start + offset] != value:
+            self.lcd.lcd_write_ddram(self.line_start + offset, [value])
+        self.lcd.lcd_shift_display_left()
+
+
+class DisplayManager:
+    """
+    Drives several RW1063 panels, on any of the four addresses and on several i2c buses.
+    Every bus gets its own worker thread, so panels on different buses are updated in parallel,
+    while the worker of a bus takes turns between its panels one DDRAM run at a time.
+    Writes go to a front frame per panel and return at once. Writes made inside transaction()
+    are handed to the workers together: no panel shows part of them without the rest.
+    """
+    def __init__(self, maxFps=30):
+        self.period = 1.0 / maxFps
+        self.panels = {}
+        self.frames = {}
+        self.workers = {}
+        self.errors = {}
+        self.condition = Condition()
+        self.generation = 0
+        self.depth = 0
+
+    def add_panel(self, name, addr=None, busNumber=None, transport=None, metrics=None, geometry=LCD_GEOMETRY_20x4):
+        """
+        Initializes the display at addr on busNumber, or on transport, and returns its Lcd. Without addr
+        the first RW1063 address answering and not taken by another panel of the bus is used.
+        Raises ValueError when there is none.
+        """
+        if transport is None and busNumber is None:
+            busNumber = default_bus_number()
+        key = id(transport) if transport is not None else busNumber
+        if addr is None:
+            addr = self._free_address(key, busNumber, transport)
+        lcd = Lcd(addr, busNumber=busNumber, transport=transport, metrics=metrics, geometry=geometry)
+        with self.condition:
+            self.panels[name] = lcd
+            self.frames[name] = [bytearray(line) for line in lcd.frame]
+            worker = self.workers.get(key)
+            if worker is None:
+                worker = self.workers[key] = _BusWorker(self)
+                worker.start()
+            worker.panels.append(name)
+        return lcd
+
+    def _free_address(self, key, busNumber, transport):
+        """ Probes the RW1063 addresses not assigned to a panel of the bus and returns the first answering. """
+        with self.condition:
+            worker = self.workers.get(key)
+            taken = {self.panels[name].i2c.addr for name in worker.panels} if worker is not None else set()
+        bus = transport if transport is not None else SharedBus.acquire(busNumber)
+        try:
+            for addr in LCD_ADDRESSES:
+                if addr not in taken and bus.probe(addr):
+                    return addr
+        finally:
+            if transport is None:
+                bus.release()
+        raise ValueError("no free RW1063 address answers on the bus")
+
+    def lcd_display_string(self, name, string, line):
+        """ Writes String at the start of line, 1 to 4, of panel name. """
+        self.lcd_frame_buffer(name, self.panels[name].encoder.rom_encode(string), line)
+
+    def lcd_frame_string(self, name, string, line, column=0):
+        """ Writes String into the frame of panel name at line, 1 to 4, starting at column. """
+        self.lcd_frame_buffer(name, self.panels[name].encoder.rom_encode(string), line, column)
+
+    def lcd_frame_buffer(self, name, buffer, line, column=0):
+        """ Writes byte buffer into the frame of panel name at line, 1 to 4, starting at column. Off-screen bytes are dropped. """
+        with self.transaction():
+            frame = self.frames[name]
+            if 1 <= line <= len(frame):
+                column, data = clip_to_row(buffer, column, len(frame[line - 1]))
+                frame[line - 1][column:column + len(data)] = data
+
+    @contextmanager
+    def transaction(self):
+        """ Groups writes to any number of panels into one update. """
+        with self.condition:
+            self.depth += 1
+            try:
+                yield self
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.generation += 1
+                    self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ Blocks until every panel shows everything written so far. Returns False on timeout. """
+        with self.condition:
+            target = self.generation
+            return self.condition.wait_for(
+                lambda: all(worker.rendered >= target or not worker.running for worker in self.workers.values()),
+                timeout)
+
+    def close(self, timeout=None):
+        """ Draws the pending updates, stops the workers and closes every panel. """
+        with self.condition:
+            for worker in self.workers.values():
+                worker.running = False
+            self.condition.notify_all()
+        for worker in self.workers.values():
+            worker.join(timeout)
+        for lcd in self.panels.values():
+            lcd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _BusWorker(Thread):
+    """ Worker of one i2c bus: copies the frames of its panels and flushes them taking turns. """
+    def __init__(self, manager):
+        super().__init__(name="lcd-bus-worker", daemon=True)
+        self.manager = manager
+        self.panels = []
+        self.rendered = 0
+        self.running = True
+
+    def run(self):
+        manager = self.manager
+        next_slot = 0.0
+        while True:
+            with manager.condition:
+                manager.condition.wait_for(lambda: manager.generation != self.rendered or not self.running)
+                if manager.generation == self.rendered:
+                    break
+            delay = next_slot - monotonic()
+            if delay > 0 and self.running:
+                sleep(delay)
+            next_slot = monotonic() + manager.period
+            with manager.condition:
+                generation = manager.generation
+                pending = list(self.panels)
+                for name in pending:
+                    for row, line in zip(manager.panels[name].frame, manager.frames[name]):
+                        row[:] = line
+            failed = False
+            while pending:
+                for name in list(pending):
+                    try:
+                        done = manager.panels[name].lcd_flush(maxRuns=1)
+                        manager.errors.pop(name, None)
+                    except OSError as error:
+                        # Keep the other panels going, this one is retried in the next slot.
+                        manager.errors[name] = error
+                        failed = done = True
+                    if done:
+                        pending.remove(name)
+            if failed and self.running:
+                continue
+            with manager.condition:
+                self.rendered = generation
+                manager.condition.notify_all()
+
+
 class CustomCharacters:
     """
     Instantiate for generating new CustomCharacters.
@@ -334,15 +1871,276 @@ class CustomCharacters:
                             "11111"]
   
     def load_custom_characters_data(self):
-        """ Loads custom character data to CG RAM for later use. """
+        """
+        Loads custom character data to CG RAM for later use. Only characters whose data differs from
+        what the driver last wrote to them are sent, consecutive ones in a single CGRAM burst.
+        """
         self.chars_list = [self.char_1_data, self.char_2_data, self.char_3_data,
                            self.char_4_data, self.char_5_data, self.char_6_data,
                            self.char_7_data, self.char_8_data]
-        
-        for char_num in range(8):
-            self.lcd.lcd_set_cgram_address(0x08 * char_num)
-            for line_num in range(8):
-                line = self.chars_list[char_num][line_num]
-                binary_str_cmd = "0b000{0}".format(line)
-                self.lcd.lcd_write_ram_data(int(binary_str_cmd, 2))
-                
+        glyphs = [compile_glyph(char_data) for char_data in self.chars_list]
+        char_num = 0
+        while char_num < LCD_CGRAM_CHARACTERS:
+            if glyphs[char_num] == self.lcd.custom_character(char_num):
+                char_num += 1
+                continue
+            first = char_num
+            while (char_num < LCD_CGRAM_CHARACTERS
+                   and glyphs[char_num] != self.lcd.custom_character(char_num)):
+                char_num += 1
+            self.lcd.lcd_write_custom_characters(first, glyphs[first:char_num])
+
+
+def compile_glyph(bitmap):
+    """
+    Returns the 8 CGRAM bytes of a 5x8 bitmap given as rows of "0"/"1" strings, like "10001",
+    or as row integers. Compiled bitmaps are cached, repeated glyphs are not parsed again.
+    """
+    return _compile_glyph(tuple(bitmap))
+
+@lru_cache(maxsize=256)
+def _compile_glyph(rows):
+    data = bytes((int(row, 2) if isinstance(row, str) else row) & 0b_0001_1111 for row in rows)
+    if len(data) != LCD_CGRAM_CHARACTER_SIZE:
+        raise ValueError("a 5x8 glyph needs 8 rows, got {}".format(len(data)))
+    return data
+
+
+class GlyphBank:
+    """
+    Registry of named glyphs sharing the 8 CGRAM characters. A glyph is uploaded the first time its
+    code is asked for, into a free character or else the least recently used one. Glyphs already in
+    CGRAM with the same bitmap are not sent again.
+    A character shown on the display or in the next frame is never taken, evicting it would change
+    those cells: codes raises ValueError when no other one is left. Ask for all the glyphs of a
+    screen together with codes() so they never evict each other.
+    """
+    def __init__(self, lcd, characters=LCD_CGRAM_CHARACTERS):
+        self.lcd = lcd
+        self.characters = characters
+        self.glyphs = {}
+        # Glyph name -> character code, least recently used first.
+        self.loaded = OrderedDict()
+
+    def register(self, name, bitmap):
+        """ Compiles and stores a glyph. A loaded glyph registered with a new bitmap is sent again on next use. """
+        self.glyphs[name] = compile_glyph(bitmap)
+
+    def code(self, name):
+        """ Returns the character code of a registered glyph, uploading it first when needed. """
+        return self.codes([name])[0]
+
+    def codes(self, names):
+        """ Returns the character codes of several glyphs, loaded together so they do not evict each other. """
+        names = list(names)
+        if len(set(names)) > self.characters:
+            raise ValueError("only {} custom characters fit in CGRAM".format(self.characters))
+        keep = set(names)
+        with self.lcd.lcd_batch():
+            return [self._load(name, keep) for name in names]
+
+    def _load(self, name, keep):
+        """ Makes sure name is in CGRAM and marks it most recently used. """
+        glyph = self.glyphs[name]
+        code = self.loaded.get(name)
+        if code is None:
+            code = self._free_code(keep)
+            self.loaded[name] = code
+        self.loaded.move_to_end(name)
+        if self.lcd.custom_character(code) != glyph:
+            self.lcd.lcd_write_custom_characters(code, [glyph])
+        return code
+
+    def _free_code(self, keep):
+        """
+        Returns an unused character code, evicting the least recently used glyph not in keep. Codes
+        on the display or in the next frame are skipped. Raises ValueError when none is left.
+        """
+        shown = self._shown_codes()
+        used = set(self.loaded.values())
+        for code in range(self.characters):
+            if code not in used and code not in shown:
+                return code
+        for name, code in self.loaded.items():
+            if name not in keep and code not in shown:
+                del self.loaded[name]
+                return code
+        raise ValueError("all {} custom characters are in use on the display".format(self.characters))
+
+    def _shown_codes(self):
+        """ Returns the character codes in the next frame and in the visible DDRAM cells. """
+        shown = set()
+        for row in self.lcd.frame:
+            shown.update(row)
+        shown.update(self.lcd.ddram[address] for address in self.lcd.cells)
+        return shown
+
+
+# Compiled animation stream: header, then per frame a list of records closed by LCD_ANIMATION_END.
+# Header: magic, frame period in microseconds, frame count, rows, columns.
+LCD_ANIMATION_MAGIC = b"RWA1"
+LCD_ANIMATION_HEADER = Struct("<4sIHBB")
+LCD_ANIMATION_END = 0x00
+# Row, column, length, then length character codes.
+LCD_ANIMATION_CELLS = 0x01
+# Character code, then the 8 CGRAM bytes of its glyph.
+LCD_ANIMATION_GLYPH = 0x02
+
+
+def compile_animation(frames, fps=20, rows=LCD_ROWS, columns=LCD_COLUMNS, encoder=None):
+    """
+    Compiles frames into an Animation holding only what changes from one frame to the next.
+    A frame is a list or tuple of rows, Strings or byte buffers; a row of None is left to other writers.
+    A frame can also be a (rows, glyphs) pair, glyphs a dict mapping character codes 0 to 7 to the bitmaps
+    they get from that frame on, as for compile_glyph. The first frame is stored in full.
+    rows and columns give the size of the animation, the display playing it must be at least as large.
+    """
+    encoder = encoder or CharacterEncoder()
+    stream = bytearray(LCD_ANIMATION_HEADER.pack(LCD_ANIMATION_MAGIC, round(1_000_000 / fps),
+                                                 len(frames), rows, columns))
+    screen = [None] * rows
+    glyphs = [None] * LCD_CGRAM_CHARACTERS
+    for frame in frames:
+        if isinstance(frame, tuple) and len(frame) == 2 and isinstance(frame[1], dict):
+            lines, frame_glyphs = frame
+        else:
+            lines, frame_glyphs = frame, {}
+        for code, bitmap in sorted(frame_glyphs.items()):
+            glyph = compile_glyph(bitmap)
+            if glyphs[code] != glyph:
+                glyphs[code] = glyph
+                stream += bytes([LCD_ANIMATION_GLYPH, code]) + glyph
+        for row, line in enumerate(list(lines)[:rows]):
+            if line is None:
+                continue
+            line = encoder.rom_encode(line) if isinstance(line, str) else bytes(line)
+            line = line[:columns].ljust(columns, bytes([LCD_SPACE_CODE]))
+            for column, data in _changed_cells(screen[row], line):
+                stream += bytes([LCD_ANIMATION_CELLS, row, column, len(data)]) + data
+            screen[row] = line
+        stream.append(LCD_ANIMATION_END)
+    return Animation(bytes(stream))
+
+def _changed_cells(previous, line):
+    """ Yields (column, data) for the runs of line that differ from previous, bridging short equal gaps. """
+    if previous is None:
+        yield 0, line
+        return
+    changed = [column for column in range(len(line)) if line[column] != previous[column]]
+    index = 0
+    while index < len(changed):
+        start = end = changed[index]
+        index += 1
+        while index < len(changed) and changed[index] - end <= LCD_FLUSH_MAX_GAP + 1:
+            end = changed[index]
+            index += 1
+        yield start, line[start:end + 1]
+
+
+class Animation:
+    """
+    Precompiled animation, see compile_animation. Frames are stored as deltas in a compact binary
+    stream that can be saved with bytes(animation) and loaded again with Animation(data).
+    Playback keeps the frame period on the monotonic clock of the display's transport: a frame that
+    falls behind is not drawn, its changes are merged into the next frame on time.
+    """
+    def __init__(self, data):
+        """ Loads a compiled stream. Raises ValueError when data is not one. """
+        self.data = bytes(data)
+        if len(self.data) < LCD_ANIMATION_HEADER.size:
+            raise ValueError("not an animation stream")
+        magic, period, count, self.rows, self.columns = LCD_ANIMATION_HEADER.unpack_from(self.data)
+        if magic != LCD_ANIMATION_MAGIC:
+            raise ValueError("not an animation stream")
+        self.period = period / 1_000_000
+        # Start of every frame in the stream.
+        self.offsets = array("I")
+        offset = LCD_ANIMATION_HEADER.size
+        for _ in range(count):
+            self.offsets.append(offset)
+            offset = self._skip_frame(offset)
+        self.dropped_frames = 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __bytes__(self):
+        return self.data
+
+    def play(self, lcd, loops=1):
+        """
+        Plays the animation on lcd loops times, forever with None. Blocks until the last frame is drawn
+        and returns the number of frames skipped to keep up. Raises ValueError when the animation is
+        larger than the display.
+        """
+        if self.rows > lcd.rows or self.columns > lcd.columns:
+            raise ValueError("a {}x{} animation does not fit a {}x{} display".format(
+                self.columns, self.rows, lcd.columns, lcd.rows))
+        scheduler = lcd.i2c.scheduler
+        total = len(self) * loops if loops is not None else None
+        # Glyph each character code got from this animation, None until it is written once.
+        glyphs = [None] * LCD_CGRAM_CHARACTERS
+        pending = {}
+        dropped = 0
+        index = 0
+        start = scheduler.clock()
+        while total is None or index < total:
+            # The frame due now, never behind the next one to draw.
+            due = max(index, int((scheduler.clock() - start) / self.period))
+            if total is not None:
+                due = min(due, total - 1)
+            for frame in range(index, due + 1):
+                self._apply(frame % len(self), lcd, pending)
+            dropped += due - index
+            self._draw(lcd, glyphs, pending)
+            index = due + 1
+            scheduler.sleep(max(0.0, start + index * self.period - scheduler.clock()))
+        self.dropped_frames += dropped
+        if dropped and lcd.metrics is not None:
+            lcd.metrics.dropped(dropped)
+        return dropped
+
+    def _skip_frame(self, offset):
+        """ Returns the offset of the record after the end of the frame at offset. """
+        data = self.data
+        while True:
+            if offset >= len(data):
+                raise ValueError("truncated animation stream")
+            op = data[offset]
+            if op == LCD_ANIMATION_END:
+                return offset + 1
+            if op == LCD_ANIMATION_CELLS:
+                offset += 4 + data[offset + 3]
+            elif op == LCD_ANIMATION_GLYPH:
+                offset += 2 + LCD_CGRAM_CHARACTER_SIZE
+            else:
+                raise ValueError("unknown animation record {:#04x}".format(op))
+
+    def _apply(self, index, lcd, pending):
+        """ Writes the cells of frame index into the lcd frame and its glyphs into pending. """
+        data = self.data
+        offset = self.offsets[index]
+        while data[offset] != LCD_ANIMATION_END:
+            if data[offset] == LCD_ANIMATION_CELLS:
+                row, column, length = data[offset + 1:offset + 4]
+                lcd.lcd_frame_buffer(data[offset + 4:offset + 4 + length], row + 1, column)
+                offset += 4 + length
+            else:
+                pending[data[offset + 1]] = data[offset + 2:offset + 2 + LCD_CGRAM_CHARACTER_SIZE]
+                offset += 2 + LCD_CGRAM_CHARACTER_SIZE
+
+    def _draw(self, lcd, glyphs, pending):
+        """ Sends the glyphs that changed, in bursts of contiguous characters, then flushes the frame, in one batch. """
+        code = 0
+        with lcd.lcd_batch():
+            while code < LCD_CGRAM_CHARACTERS:
+                if code not in pending or pending[code] == glyphs[code]:
+                    code += 1
+                    continue
+                first = code
+                while code < LCD_CGRAM_CHARACTERS and code in pending and pending[code] != glyphs[code]:
+                    glyphs[code] = pending[code]
+                    code += 1
+                lcd.lcd_write_custom_characters(first, glyphs[first:code])
+            pending.clear()
+            lcd.lcd_flush()
@@ -0,0 +1,299 @@
+"""
+Display server: one process owns the i2c bus and the Lcd, other processes draw through it.
+The server initializes the display once and shares a framebuffer file mapped in memory, the rows x
+columns character codes followed by the 64 CGRAM bytes. Clients claim a region of cells and custom
+characters, write into the mapped framebuffer and ask for a flush over a Unix socket. Flush requests
+arriving together are served by one update with only the cells that changed.
+
+    python lcdserver.py --bus 1
+
+    client = LcdClient()
+    client.claim(line=1, column=12, width=8)
+    client.lcd_frame_string("21.5°C", 1, 12)
+    client.lcd_flush()
+
+Protocol, one text line per request and per reply ("OK ..." or "ERR message"):
+HELLO, CLAIM line column width height, CHARACTERS first count and FLUSH. Claims of a client are
+released when it disconnects. Ownership is cooperative: LcdClient refuses writes outside its claims.
+"""
+
+import argparse
+import socket
+import sys
+from mmap import mmap
+from os import environ, unlink
+from os.path import join, exists
+from selectors import DefaultSelector, EVENT_READ
+
+import lcdrw1063 as LCD
+
+LCD_SERVER_SOCKET = join(environ.get("XDG_RUNTIME_DIR") or "/tmp", "lcdrw1063.sock")
+
+
+class LcdServer:
+    """
+    Serves lcd, an Lcd instance, to the clients connecting to the Unix socket at path.
+    The framebuffer is the file path + ".fb", keep path on a tmpfs such as /run so it stays in memory.
+    """
+    def __init__(self, lcd, path=LCD_SERVER_SOCKET):
+        self.lcd = lcd
+        self.path = path
+        self.framebuffer_path = path + ".fb"
+        self.rows = lcd.rows
+        self.columns = lcd.columns
+        self.cgram_offset = self.rows * self.columns
+        with open(self.framebuffer_path, "w+b") as framebuffer_file:
+            framebuffer_file.truncate(self.cgram_offset + LCD.LCD_CGRAM_SIZE)
+            self.framebuffer = mmap(framebuffer_file.fileno(), 0)
+        for row, line in enumerate(lcd.frame):
+            self.framebuffer[row * self.columns:(row + 1) * self.columns] = bytes(line)
+        # CGRAM content is unknown after reset, start from the blank glyphs of the framebuffer.
+        self.lcd.lcd_write_custom_characters(0, [bytes(LCD.LCD_CGRAM_CHARACTER_SIZE)] * LCD.LCD_CGRAM_CHARACTERS)
+        # Client socket -> list of ("cells", row, column, height, width) and ("characters", first, count).
+        self.claims = {}
+        self.buffers = {}
+        self.selector = DefaultSelector()
+        if exists(path):
+            unlink(path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen()
+        self.selector.register(self.listener, EVENT_READ)
+        self.running = True
+
+    def serve_forever(self):
+        """ Serves requests until close is called. """
+        while self.running:
+            self.serve_once()
+
+    def serve_once(self, timeout=0.5):
+        """ Waits up to timeout seconds for requests and serves them; pending flushes become one update. """
+        flushes = []
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj is self.listener:
+                client, _ = self.listener.accept()
+                self.claims[client] = []
+                self.buffers[client] = b""
+                self.selector.register(client, EVENT_READ)
+                continue
+            client = key.fileobj
+            try:
+                data = client.recv(4096)
+            except OSError:
+                data = b""
+            if not data:
+                self._disconnect(client)
+                continue
+            self.buffers[client] += data
+            *requests, self.buffers[client] = self.buffers[client].split(b"\n")
+            for request in requests:
+                if client not in self.claims:
+                    break
+                if request.strip() == b"FLUSH":
+                    flushes.append(client)
+                else:
+                    self._reply(client, self._handle(client, request.decode("ascii", "replace").split()))
+        if flushes:
+            try:
+                self.flush()
+                reply = "OK"
+            except OSError as error:
+                reply = "ERR {}".format(error)
+            for client in flushes:
+                self._reply(client, reply)
+
+    def flush(self):
+        """ Sends the custom characters and cells of the framebuffer that differ from what the display shows, in one batch. """
+        lcd = self.lcd
+        cgram = self.framebuffer[self.cgram_offset:self.cgram_offset + LCD.LCD_CGRAM_SIZE]
+        glyphs = [cgram[code * LCD.LCD_CGRAM_CHARACTER_SIZE:(code + 1) * LCD.LCD_CGRAM_CHARACTER_SIZE]
+                  for code in range(LCD.LCD_CGRAM_CHARACTERS)]
+        loaded = [bytes(lcd.cgram[code * LCD.LCD_CGRAM_CHARACTER_SIZE:(code + 1) * LCD.LCD_CGRAM_CHARACTER_SIZE])
+                  for code in range(LCD.LCD_CGRAM_CHARACTERS)]
+        code = 0
+        with lcd.lcd_batch():
+            while code < LCD.LCD_CGRAM_CHARACTERS:
+                if glyphs[code] == loaded[code]:
+                    code += 1
+                    continue
+                first = code
+                while code < LCD.LCD_CGRAM_CHARACTERS and glyphs[code] != loaded[code]:
+                    code += 1
+                lcd.lcd_write_custom_characters(first, glyphs[first:code])
+            for row in range(self.rows):
+                lcd.lcd_frame_buffer(self.framebuffer[row * self.columns:(row + 1) * self.columns], row + 1)
+            lcd.lcd_flush()
+
+    def close(self):
+        """ Disconnects every client, removes the socket and the framebuffer and closes the display. """
+        self.running = False
+        for client in list(self.claims):
+            self._disconnect(client)
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        self.selector.close()
+        self.framebuffer.close()
+        for path in (self.path, self.framebuffer_path):
+            if exists(path):
+                unlink(path)
+        self.lcd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _handle(self, client, request):
+        """ Serves every request but FLUSH and returns the reply. """
+        try:
+            if request[:1] == ["HELLO"]:
+                return "OK {} {} {}".format(self.rows, self.columns, self.framebuffer_path)
+            if request[:1] == ["CLAIM"] and len(request) == 5:
+                line, column, width, height = (int(value) for value in request[1:])
+                claim = ("cells", line - 1, column, height, width)
+                if not (0 <= claim[1] and claim[1] + height <= self.rows
+                        and 0 <= column and column + width <= self.columns and width > 0 and height > 0):
+                    return "ERR region outside the display"
+            elif request[:1] == ["CHARACTERS"] and len(request) == 3:
+                first, count = (int(value) for value in request[1:])
+                claim = ("characters", first, count)
+                if not (0 <= first and first + count <= LCD.LCD_CGRAM_CHARACTERS and count > 0):
+                    return "ERR custom characters are 0 to {}".format(LCD.LCD_CGRAM_CHARACTERS - 1)
+            else:
+                return "ERR unknown request"
+        except ValueError:
+            return "ERR malformed request"
+        for claims in self.claims.values():
+            if any(_overlap(claim, other) for other in claims):
+                return "ERR {} already claimed".format("region" if claim[0] == "cells" else "characters")
+        self.claims[client].append(claim)
+        return "OK"
+
+    def _reply(self, client, reply):
+        try:
+            client.sendall(reply.encode("ascii") + b"\n")
+        except OSError:
+            self._disconnect(client)
+
+    def _disconnect(self, client):
+        """ Forgets a client and releases its claims. """
+        if client in self.claims:
+            del self.claims[client]
+            del self.buffers[client]
+            self.selector.unregister(client)
+            client.close()
+
+
+def _overlap(claim, other):
+    """ Returns True when two claims of the same kind share a cell or a character. """
+    if claim[0] != other[0]:
+        return False
+    if claim[0] == "characters":
+        return claim[1] < other[1] + other[2] and other[1] < claim[1] + claim[2]
+    _, row, column, height, width = claim
+    _, other_row, other_column, other_height, other_width = other
+    return (row < other_row + other_height and other_row < row + height
+            and column < other_column + other_width and other_column < column + width)
+
+
+class LcdClient:
+    """
+    Client of an LcdServer. Writes go straight into the shared framebuffer, within the regions and
+    custom characters claimed, and reach the display on lcd_flush.
+    """
+    def __init__(self, path=LCD_SERVER_SOCKET):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.replies = self.socket.makefile("rb")
+        rows, columns, framebuffer_path = self._request("HELLO").split(" ", 2)
+        self.rows, self.columns = int(rows), int(columns)
+        self.cgram_offset = self.rows * self.columns
+        with open(framebuffer_path, "r+b") as framebuffer_file:
+            self.framebuffer = mmap(framebuffer_file.fileno(), 0)
+        self.cells = set()
+        self.characters = set()
+        self.encoder = LCD.CharacterEncoder()
+
+    def claim(self, line, column=0, width=None, height=1):
+        """ Claims height lines from line, 1 to 4, width cells from column, to the end of the line by default. """
+        width = self.columns - column if width is None else width
+        self._request("CLAIM {} {} {} {}".format(line, column, width, height))
+        self.cells.update((row, cell) for row in range(line - 1, line - 1 + height)
+                          for cell in range(column, column + width))
+
+    def claim_characters(self, first, count=1):
+        """ Claims the custom characters first to first + count - 1. """
+        self._request("CHARACTERS {} {}".format(first, count))
+        self.characters.update(range(first, first + count))
+
+    def lcd_frame_string(self, string, line, column=0):
+        """ Writes String into the framebuffer at line, 1 to 4, starting at column. """
+        self.lcd_frame_buffer(self.encoder.rom_encode(string), line, column)
+
+    def lcd_frame_buffer(self, buffer, line, column=0):
+        """
+        Writes byte buffer into the framebuffer at line, 1 to 4, starting at column. Off-screen bytes are
+        dropped, raises ValueError when the others are outside the claims.
+        """
+        if not 1 <= line <= self.rows:
+            return
+        column, data = LCD.clip_to_row(buffer, column, self.columns)
+        if any((line - 1, cell) not in self.cells for cell in range(column, column + len(data))):
+            raise ValueError("cells outside the claimed regions")
+        offset = (line - 1) * self.columns + column
+        self.framebuffer[offset:offset + len(data)] = data
+
+    def lcd_write_custom_characters(self, firstCode, glyphs):
+        """ Writes the 8 byte bitmaps in glyphs to the framebuffer CGRAM for firstCode, firstCode + 1, ... """
+        glyphs = [bytes(glyph) for glyph in glyphs]
+        if any(code not in self.characters for code in range(firstCode, firstCode + len(glyphs))):
+            raise ValueError("custom characters not claimed")
+        offset = self.cgram_offset + firstCode * LCD.LCD_CGRAM_CHARACTER_SIZE
+        data = b"".join(glyphs)
+        self.framebuffer[offset:offset + len(data)] = data
+
+    def lcd_flush(self):
+        """ Asks the server to update the display and waits until it did. """
+        self._request("FLUSH")
+
+    def close(self):
+        """ Disconnects, the server releases the claims. """
+        self.framebuffer.close()
+        self.replies.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, request):
+        """ Sends a request and returns the text after "OK". Raises ValueError on an error reply. """
+        self.socket.sendall(request.encode("ascii") + b"\n")
+        reply = self.replies.readline().decode("ascii").rstrip("\n")
+        if not reply:
+            raise ConnectionError("display server closed the connection")
+        if not reply.startswith("OK"):
+            raise ValueError(reply[4:])
+        return reply[3:]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bus", type=int, help="i2c bus number, the default bus when omitted")
+    parser.add_argument("--addr", type=lambda value: int(value, 0), help="display address, autodetected when omitted")
+    parser.add_argument("--socket", default=LCD_SERVER_SOCKET, help="Unix socket path")
+    args = parser.parse_args(argv)
+
+    with LcdServer(LCD.Lcd(addr=args.addr, busNumber=args.bus), args.socket) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
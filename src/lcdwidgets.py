@@ -0,0 +1,221 @@
+"""
+Bar graph, sparkline and big digit widgets for the lcdrw1063 driver.
+A widget draws into the frame of an Lcd, only the cells that changed since it last drew, and the
+caller sends every widget of the screen at once with lcd_flush:
+
+    cpu = HorizontalBar(display, line=1, column=4, width=16)
+    memory = HorizontalBar(display, line=2, column=4, width=16)
+    cpu.render(42)
+    memory.render(73)
+    display.lcd_flush()
+
+Values are turned into cells through lookup tables built once per widget: the value gives a level,
+the level a row of palette indices, bytes.translate maps those to character codes. Sequences of
+values are converted in one pass, with NumPy when it is installed.
+The custom characters come from lcd.glyphs, the GlyphBank the display shares with the CGRAM
+fallback of its encoder. Widgets drawn together must not need more than 8 glyphs between them:
+horizontal bars share 4, vertical bars and sparklines 7, big digits 7. When a widget needs a
+character still on the display, the GlyphBank raises ValueError instead of changing those cells.
+"""
+
+from lcdrw1063 import compile_glyph, LCD_SPACE_CODE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Character ROM code of the full block.
+LCD_FULL_BLOCK_CODE = 0xFF
+
+# Horizontal bar cells with 0 to 5 columns filled. A character code is taken from the ROM.
+HBAR_PALETTE = [LCD_SPACE_CODE] + [[("1" * filled).ljust(5, "0")] * 8 for filled in range(1, 5)] + [LCD_FULL_BLOCK_CODE]
+# Vertical bar cells with 0 to 8 rows filled from the bottom.
+VBAR_PALETTE = ([LCD_SPACE_CODE] + [["00000"] * (8 - filled) + ["11111"] * filled for filled in range(1, 8)]
+                + [LCD_FULL_BLOCK_CODE])
+
+# Big digit pieces: corners, bars and blank, 3 cells wide and 2 rows high per digit.
+_LT = ["00111", "01111", "11111", "11111", "11111", "11111", "11111", "11111"]
+_UB = ["11111", "11111", "11111", "00000", "00000", "00000", "00000", "00000"]
+_RT = ["11100", "11110", "11111", "11111", "11111", "11111", "11111", "11111"]
+_LL = ["11111", "11111", "11111", "11111", "11111", "11111", "01111", "00111"]
+_LB = ["00000", "00000", "00000", "00000", "00000", "11111", "11111", "11111"]
+_LR = ["11111", "11111", "11111", "11111", "11111", "11111", "11110", "11100"]
+_UMB = ["11111", "11111", "11111", "00000", "00000", "00000", "11111", "11111"]
+BIG_DIGIT_PALETTE = [_LT, _UB, _RT, _LL, _LB, _LR, _UMB, LCD_SPACE_CODE, LCD_FULL_BLOCK_CODE]
+LT, UB, RT, LL, LB, LR, UMB, BL, FB = range(len(BIG_DIGIT_PALETTE))
+# Character -> (top row, bottom row) in BIG_DIGIT_PALETTE indices.
+BIG_DIGITS = {
+    "0": ((LT, UB, RT), (LL, LB, LR)),
+    "1": ((UB, RT, BL), (LB, FB, LB)),
+    "2": ((UMB, UMB, RT), (LL, LB, LB)),
+    "3": ((UMB, UMB, RT), (LB, LB, LR)),
+    "4": ((LL, LB, FB), (BL, BL, FB)),
+    "5": ((LL, UMB, UMB), (LB, LB, LR)),
+    "6": ((LT, UMB, UMB), (LL, LB, LR)),
+    "7": ((UB, UB, RT), (BL, BL, FB)),
+    "8": ((LT, UMB, RT), (LL, LB, LR)),
+    "9": ((LT, UMB, RT), (BL, BL, FB)),
+    "-": ((BL, BL, BL), (UB, UB, UB)),
+    " ": ((BL, BL, BL), (BL, BL, BL)),
+}
+
+class Widget:
+    """
+    Base of the widgets: a palette of cells, ROM character codes or glyph bitmaps, and the rows it
+    last drew. Subclasses compute palette indices and hand them to _draw.
+    """
+    def __init__(self, lcd, line, column, palette, glyphs=None):
+        self.lcd = lcd
+        self.line = line
+        self.column = column
+        self.glyphs = glyphs if glyphs is not None else lcd.glyphs
+        # Glyphs are named by their bitmap, widgets drawing the same glyph share its character.
+        self.entries = []
+        for entry in palette:
+            if not isinstance(entry, int):
+                data = compile_glyph(entry)
+                entry = ("widget", data)
+                self.glyphs.register(entry, data)
+            self.entries.append(entry)
+        self.names = [entry for entry in self.entries if not isinstance(entry, int)]
+        self.codes = None
+        self.translation = None
+        # Line -> character codes drawn there.
+        self.shown = {}
+
+    def _translation(self):
+        """ Returns the palette index -> character code table, loading the glyphs when needed. """
+        codes = self.glyphs.codes(self.names) if self.names else []
+        if codes != self.codes:
+            # Glyphs moved to other characters, the cells drawn with the old codes are redrawn.
+            self.shown.clear()
+            glyph_codes = iter(codes)
+            self.translation = bytes(entry if isinstance(entry, int) else next(glyph_codes)
+                                     for entry in self.entries).ljust(256, b"\0")
+            self.codes = codes
+        return self.translation
+
+    def _draw(self, rows):
+        """ Translates rows of palette indices, top row first, and writes the cells that changed. """
+        translation = self._translation()
+        for offset, row in enumerate(rows):
+            line = self.line + offset
+            data = bytes(row).translate(translation)
+            shown = self.shown.get(line)
+            if shown is not None and len(shown) > len(data):
+                # Blank what a longer row left behind.
+                data = data.ljust(len(shown), bytes([LCD_SPACE_CODE]))
+            if shown is not None and len(shown) == len(data):
+                span = _changed_span(shown, data)
+                if span is None:
+                    continue
+                start, end = span
+            else:
+                start, end = 0, len(data)
+            self.lcd.lcd_frame_buffer(data[start:end], line, self.column + start)
+            self.shown[line] = data
+
+
+def _changed_span(old, new):
+    """
+    Returns (start, end) of the cells that differ between two rows of the same length, or None.
+    Compares the rows as integers, without a loop over the cells.
+    """
+    difference = int.from_bytes(old, "big") ^ int.from_bytes(new, "big")
+    if not difference:
+        return None
+    # Bytes are big endian: the highest differing bit is in the first differing cell.
+    start = len(new) - (difference.bit_length() + 7) // 8
+    end = len(new) - ((difference & -difference).bit_length() - 1) // 8
+    return start, end
+
+
+class HorizontalBar(Widget):
+    """
+    Gauge filling width cells of line, 1 to 4, from column on, with a resolution of 5 steps per cell.
+    palette holds the cells with 0 to 5 columns filled, HBAR_PALETTE by default.
+    """
+    def __init__(self, lcd, line, column=0, width=None, minimum=0, maximum=100, palette=HBAR_PALETTE, glyphs=None):
+        super().__init__(lcd, line, column, palette, glyphs)
+        self.width = lcd.columns - column if width is None else width
+        self.minimum = minimum
+        steps = len(palette) - 1
+        self.levels = self.width * steps
+        self.scale = self.levels / (maximum - minimum)
+        # Level -> row of palette indices.
+        self.table = [bytes([steps] * (level // steps) + [level % steps] * (level % steps > 0)).ljust(self.width, b"\0")
+                      for level in range(self.levels + 1)]
+
+    def render(self, value):
+        """ Draws value, clamped to minimum - maximum. """
+        level = min(self.levels, max(0, round((value - self.minimum) * self.scale)))
+        self._draw([self.table[level]])
+
+
+class VerticalBars(Widget):
+    """
+    Bar graph of count bars, one per cell, growing up height rows from line, 1 to 4, the bottom row
+    being line + height - 1. Each row of cells adds 8 steps of resolution.
+    """
+    def __init__(self, lcd, line, column=0, count=None, height=1, minimum=0, maximum=100,
+                 palette=VBAR_PALETTE, glyphs=None):
+        super().__init__(lcd, line, column, palette, glyphs)
+        self.count = lcd.columns - column if count is None else count
+        self.height = height
+        self.minimum = minimum
+        steps = len(palette) - 1
+        self.levels = height * steps
+        if self.levels > 255:
+            raise ValueError("at most {} rows".format(255 // steps))
+        self.scale = self.levels / (maximum - minimum)
+        # Per row, top row first: level -> palette index, as translation tables.
+        self.tables = [bytes(min(steps, max(0, level - steps * (height - 1 - row))) for level in range(256))
+                       for row in range(height)]
+        if numpy is not None:
+            self.array_tables = numpy.frombuffer(b"".join(self.tables), numpy.uint8).reshape(height, 256)
+
+    def render(self, values):
+        """ Draws the first count values, one bar each, clamped to minimum - maximum. """
+        values = values[:self.count]
+        if numpy is not None:
+            levels = numpy.rint((numpy.asarray(values, dtype=float) - self.minimum) * self.scale)
+            levels = numpy.clip(levels, 0, self.levels).astype(numpy.uint8)
+            rows = [row.tobytes() for row in self.array_tables[:, levels]]
+        else:
+            levels = bytes(min(self.levels, max(0, round((value - self.minimum) * self.scale))) for value in values)
+            rows = [levels.translate(table) for table in self.tables]
+        self._draw(rows)
+
+
+class Sparkline(VerticalBars):
+    """ VerticalBars showing the last count values pushed, newest on the right. """
+    def __init__(self, lcd, line, column=0, count=None, height=1, minimum=0, maximum=100,
+                 palette=VBAR_PALETTE, glyphs=None):
+        super().__init__(lcd, line, column, count, height, minimum, maximum, palette, glyphs)
+        self.history = [minimum] * self.count
+
+    def push(self, *values):
+        """ Appends values and draws the last count of them. """
+        self.history = (self.history + list(values))[-self.count:]
+        self.render(self.history)
+
+
+class BigDigits(Widget):
+    """
+    Numbers 2 rows high from line, 1 to 3, and column on. Every character of BIG_DIGITS takes
+    3 cells and a blank one.
+    """
+    def __init__(self, lcd, line, column=0, glyphs=None):
+        super().__init__(lcd, line, column, BIG_DIGIT_PALETTE, glyphs)
+        # Character -> (top row, bottom row) of palette indices, spacing column included.
+        self.table = {character: (bytes(top + (BL,)), bytes(bottom + (BL,)))
+                      for character, (top, bottom) in BIG_DIGITS.items()}
+
+    def render(self, text):
+        """ Draws text, digits, "-" and spaces. Raises ValueError for other characters. """
+        try:
+            cells = [self.table[character] for character in str(text)]
+        except KeyError as error:
+            raise ValueError("no big digit for {!r}".format(error.args[0]))
+        self._draw([b"".join(top for top, _ in cells), b"".join(bottom for _, bottom in cells)])
@@ -0,0 +1,279 @@
+"""
+Software model of the RW1063 LCD driver & controller and an emulated i2c bus.
+Plug EmulatorBus into Lcd as its transport to run the driver without a display:
+
+    bus = EmulatorBus()
+    emulator = bus.attach(RW1063Emulator())
+    display = Lcd(transport=bus)
+    display.lcd_display_string("Hello", 1)
+    emulator.screen()  # ['Hello               ', '', ...]
+
+The bus keeps virtual time: transactions advance it by their modeled i2c duration and the driver
+scheduler sleeps on it, so emulated runs take no wall-clock time.
+"""
+
+from errno import EREMOTEIO
+from threading import RLock
+
+from lcdrw1063 import (LCD_ADDRESS_3C, LCD_IR_DATA_WRITE_OP, LCD_SPACE_CODE, LCD_DDRAM_SIZE,
+                       LCD_DDRAM_LINE_LENGTH, LCD_DDRAM_LINE2_ADDRESS, LCD_CGRAM_SIZE,
+                       LCD_COLUMNS, LCD_LINE_BASE_ADDRESSES, LCD_DR_SET_DDRAM_ADDRESS,
+                       LCD_DR_SET_CGRAM_ADDRESS, LCD_DR_FUNCTION_SET, LCD_DR_CURSOR_DISPLAY_SHIFT,
+                       LCD_DR_DISPLAY_ON_OFF, LCD_DR_ENTRY_MODE_SET, LCD_DR_RETURN_HOME,
+                       LCD_DR_CLEAR_DISPLAY, LCD_FOSC_TYPICAL, LCD_EXEC_TIME_DATA_WRITE,
+                       instruction_execution_time)
+
+# Standard mode i2c clock, the Raspberry Pi default.
+I2C_FREQUENCY = 100_000
+# Every byte on the bus takes 8 data bits and the acknowledge bit.
+I2C_BITS_PER_BYTE = 9
+# Start and stop conditions, about one clock each.
+I2C_FRAMING_BITS = 2
+
+# Control byte bits. Co = 1: one byte follows, then another control byte. A0 = 1: RAM data.
+RW1063_CONTROL_CO = 0b_1000_0000
+RW1063_CONTROL_A0 = LCD_IR_DATA_WRITE_OP
+
+# Bits of the instructions decoded by the model.
+RW1063_ENTRY_INCREMENT     = 0b_0000_0010
+RW1063_ENTRY_SHIFT         = 0b_0000_0001
+RW1063_DISPLAY_ON          = 0b_0000_0100
+RW1063_DISPLAY_CURSOR      = 0b_0000_0010
+RW1063_DISPLAY_BLINK       = 0b_0000_0001
+RW1063_SHIFT_DISPLAY       = 0b_0000_1000
+RW1063_SHIFT_RIGHT         = 0b_0000_0100
+RW1063_FUNCTION_8BIT       = 0b_0001_0000
+RW1063_FUNCTION_TWO_LINE   = 0b_0000_1000
+RW1063_FUNCTION_FONT_5x11  = 0b_0000_0100
+
+
+class RW1063Emulator:
+    """
+    Model of one RW1063: instruction and data register decoding, DDRAM, CGRAM, address counter,
+    entry mode, display on/off and display shift. Bytes arriving while the previous instruction is
+    still executing are dropped, like on the hardware, and counted in busy_violations.
+    """
+    def __init__(self, columns=LCD_COLUMNS, rowAddresses=LCD_LINE_BASE_ADDRESSES, fosc=LCD_FOSC_TYPICAL):
+        """ Models a controller at power-on reset, wired to a panel of columns x len(rowAddresses). """
+        self.columns = columns
+        self.row_addresses = [address & 0x7F for address in rowAddresses]
+        self.fosc = fosc
+        self.ddram = bytearray([LCD_SPACE_CODE] * LCD_DDRAM_SIZE)
+        self.cgram = bytearray(LCD_CGRAM_SIZE)
+        self.address_counter = 0
+        self.cgram_selected = False
+        self.increment = True
+        self.entry_shift = False
+        self.display_on = False
+        self.cursor_on = False
+        self.blink_on = False
+        self.eight_bit = True
+        self.two_line = False
+        self.font_5x11 = False
+        self.display_shift = 0
+        self.busy_until = 0.0
+        self.busy_violations = 0
+        self.instructions = 0
+        self.data_writes = 0
+
+    def receive(self, control, data, start, frequency=I2C_FREQUENCY):
+        """
+        Decodes one i2c write that started at time start: control byte, then data. The byte at
+        position n of the transaction is latched n byte times after the start.
+        """
+        stream = [control] + list(data)
+        byte_time = I2C_BITS_PER_BYTE / frequency
+        # The slave address byte comes first.
+        position = 1
+        index = 0
+        while index < len(stream):
+            control = stream[index]
+            index += 1
+            position += 1
+            last = index + 1 if control & RW1063_CONTROL_CO else len(stream)
+            for value in stream[index:last]:
+                position += 1
+                self._latch(bool(control & RW1063_CONTROL_A0), value, start + position * byte_time)
+            index = last
+
+    def _latch(self, ramData, value, now):
+        """ Executes a single instruction or RAM data byte received at time now. """
+        if now < self.busy_until:
+            self.busy_violations += 1
+            return
+        if ramData:
+            self._write_ram(value)
+            self.busy_until = now + LCD_EXEC_TIME_DATA_WRITE * LCD_FOSC_TYPICAL / self.fosc
+        else:
+            self._execute(value)
+            self.busy_until = now + instruction_execution_time(value, self.fosc)
+
+    def _execute(self, command):
+        """ Decodes an instruction code by its highest set bit. """
+        self.instructions += 1
+        if command & LCD_DR_SET_DDRAM_ADDRESS:
+            self.address_counter = command & 0x7F
+            self.cgram_selected = False
+        elif command & LCD_DR_SET_CGRAM_ADDRESS:
+            self.address_counter = command & 0x3F
+            self.cgram_selected = True
+        elif command & LCD_DR_FUNCTION_SET:
+            self.eight_bit = bool(command & RW1063_FUNCTION_8BIT)
+            self.two_line = bool(command & RW1063_FUNCTION_TWO_LINE)
+            self.font_5x11 = bool(command & RW1063_FUNCTION_FONT_5x11)
+        elif command & LCD_DR_CURSOR_DISPLAY_SHIFT:
+            step = 1 if command & RW1063_SHIFT_RIGHT else -1
+            if command & RW1063_SHIFT_DISPLAY:
+                self.display_shift = (self.display_shift - step) % self._line_length()
+            else:
+                self.address_counter = self._next_address(self.address_counter, step)
+        elif command & LCD_DR_DISPLAY_ON_OFF:
+            self.display_on = bool(command & RW1063_DISPLAY_ON)
+            self.cursor_on = bool(command & RW1063_DISPLAY_CURSOR)
+            self.blink_on = bool(command & RW1063_DISPLAY_BLINK)
+        elif command & LCD_DR_ENTRY_MODE_SET:
+            self.increment = bool(command & RW1063_ENTRY_INCREMENT)
+            self.entry_shift = bool(command & RW1063_ENTRY_SHIFT)
+        elif command & LCD_DR_RETURN_HOME:
+            self.address_counter = 0
+            self.cgram_selected = False
+            self.display_shift = 0
+        elif command & LCD_DR_CLEAR_DISPLAY:
+            self.ddram[:] = bytes([LCD_SPACE_CODE]) * LCD_DDRAM_SIZE
+            self.address_counter = 0
+            self.cgram_selected = False
+            self.display_shift = 0
+            self.increment = True
+
+    def _write_ram(self, value):
+        """ Stores a data byte at the address counter and moves it according to the entry mode. """
+        self.data_writes += 1
+        step = 1 if self.increment else -1
+        if self.cgram_selected:
+            self.cgram[self.address_counter] = value
+            self.address_counter = (self.address_counter + step) % LCD_CGRAM_SIZE
+            return
+        self.ddram[self.address_counter] = value
+        self.address_counter = self._next_address(self.address_counter, step)
+        if self.entry_shift:
+            # I/D = 1 shifts the display to the left, I/D = 0 to the right.
+            self.display_shift = (self.display_shift + step) % self._line_length()
+
+    def _line_length(self):
+        """ DDRAM line length: two lines of 40 in 2-line mode, a single line of 80 otherwise. """
+        return LCD_DDRAM_LINE_LENGTH if self.two_line else 2 * LCD_DDRAM_LINE_LENGTH
+
+    def _next_address(self, address, step):
+        """ Returns the DDRAM address after address, wrapping like the address counter does. """
+        if not self.two_line:
+            return (address + step) % (2 * LCD_DDRAM_LINE_LENGTH)
+        line_start = LCD_DDRAM_LINE2_ADDRESS if address >= LCD_DDRAM_LINE2_ADDRESS else 0
+        other_start = 0 if line_start else LCD_DDRAM_LINE2_ADDRESS
+        offset = address - line_start + step
+        if offset >= LCD_DDRAM_LINE_LENGTH:
+            return other_start
+        if offset < 0:
+            return other_start + LCD_DDRAM_LINE_LENGTH - 1
+        return line_start + offset
+
+    def visible_address(self, row, column):
+        """ Returns the DDRAM address shown at row, column, taking the display shift into account. """
+        base = self.row_addresses[row]
+        length = self._line_length()
+        line_start = LCD_DDRAM_LINE2_ADDRESS if self.two_line and base >= LCD_DDRAM_LINE2_ADDRESS else 0
+        return line_start + (base - line_start + column + self.display_shift) % length
+
+    def screen_codes(self):
+        """ Returns the character codes on the panel, one bytes object per row. """
+        return [bytes(self.ddram[self.visible_address(row, column)] for column in range(self.columns))
+                for row in range(len(self.row_addresses))]
+
+    def screen(self):
+        """ Returns the panel as text, one string per row. Custom characters show as their code. """
+        return ["".join(chr(code) if code >= LCD_SPACE_CODE else str(code) for code in line)
+                for line in self.screen_codes()]
+
+
+class EmulatorBus:
+    """
+    Emulated i2c bus with RW1063Emulator devices attached, usable as an I2CDevice transport.
+    Counts transactions, bytes and modeled bus time, and keeps its own virtual clock.
+    """
+    busNumber = None
+
+    def __init__(self, frequency=I2C_FREQUENCY):
+        self.frequency = frequency
+        self.devices = {}
+        self.lock = RLock()
+        self.now = 0.0
+        self.reset_stats()
+
+    def attach(self, emulator, addr=LCD_ADDRESS_3C):
+        """ Connects an emulated controller at addr and returns it. """
+        self.devices[addr] = emulator
+        return emulator
+
+    def detach(self, addr=LCD_ADDRESS_3C):
+        """ Disconnects the device at addr, like a power loss, and returns it. """
+        return self.devices.pop(addr, None)
+
+    def reset_stats(self):
+        """ Zeroes the transaction, byte and bus time counters. """
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_time = 0.0
+
+    def transaction_time(self, length):
+        """ Returns the modeled duration of a write of length bytes after the address byte. """
+        return (I2C_BITS_PER_BYTE * (length + 1) + I2C_FRAMING_BITS) / self.frequency
+
+    def clock(self):
+        """ Virtual time in seconds. """
+        return self.now
+
+    def sleep(self, seconds):
+        """ Advances virtual time. """
+        self.now += max(0.0, seconds)
+
+    def write_i2c_block_data(self, addr, cmd, data):
+        """ Delivers a block write to the device at addr. Raises OSError when nothing acknowledges. """
+        with self.lock:
+            device = self.devices.get(addr)
+            duration = self.transaction_time(1 + len(data))
+            start = self.now
+            self.now += duration
+            self.transactions += 1
+            self.bytes += 1 + len(data)
+            self.bus_time += duration
+            if device is None:
+                raise OSError(EREMOTEIO, "no acknowledge from address {:#04x}".format(addr))
+            device.receive(cmd, data, start, self.frequency)
+
+    def write_i2c_messages(self, addr, messages):
+        """
+        Delivers write messages to the device at addr as one combined transfer: a single start, a
+        repeated start and address byte before every message, one stop.
+        """
+        with self.lock:
+            device = self.devices.get(addr)
+            start = self.now
+            length = sum(len(message) for message in messages)
+            duration = (I2C_BITS_PER_BYTE * (length + len(messages)) + I2C_FRAMING_BITS * len(messages)) / self.frequency
+            self.now += duration
+            self.transactions += 1
+            self.bytes += length
+            self.bus_time += duration
+            if device is None:
+                raise OSError(EREMOTEIO, "no acknowledge from address {:#04x}".format(addr))
+            for message in messages:
+                device.receive(message[0], message[1:], start, self.frequency)
+                start += self.transaction_time(len(message))
+
+    def probe(self, addr):
+        """ Returns True if a device is attached at addr. """
+        with self.lock:
+            self.now += self.transaction_time(0)
+            return addr in self.devices
+
+    def release(self):
+        """ Nothing to close, present for the transport interface. """
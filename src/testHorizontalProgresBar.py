@@ -1,4 +1,5 @@
 import lcdrw1063 as LCD
+from lcdwidgets import HorizontalBar
 from time import sleep
 
 
@@ -58,19 +59,15 @@ custom.char_6_data = ["11111",
                       "00000",
                       "11111"]
 
-custom.load_custom_characters_data()
 display.lcd_clear_display()
 
-buffer = [0]*20
-display.lcd_display_buffer(buffer, 1)
+# Cells with 0 to 5 columns filled, drawn with the custom characters above.
+bar = HorizontalBar(display, line=1, width=20, maximum=100,
+                    palette=[custom.char_1_data, custom.char_2_data, custom.char_3_data,
+                             custom.char_4_data, custom.char_5_data, custom.char_6_data])
 
 while True:
     for i in range(100) :
-        for j in range (int(i / 5)) :
-            buffer[j] = 5
-        if (i % 5) > 0:
-            buffer[int(i/5)] = i % 5
-        for k in range (int(i / 5) + 1, 20) :
-            buffer[k] = 0
-        display.lcd_display_buffer(buffer, 1)
+        bar.render(i)
+        display.lcd_flush()  # Sends only the cells changed since the last step
         # sleep(.01) 
@@ -22,31 +22,21 @@ display.lcd_clear_display()
 display.lcd_display_buffer([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], 1)
 display.lcd_display_buffer([255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255], 3)
 display.lcd_display_buffer([255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255,255], 4)
-while True:
-    display.lcd_display_buffer([0,1,2,3,4,5,6,7,0,1,2,3,4,5,6,7,0,1,2,3], 2)
-    sleep(.05)                                               
-    display.lcd_display_buffer([1,2,3,4,5,6,7,6,1,2,3,4,5,6,7,6,1,2,3,4], 2)
-    sleep(.05)                                                
-    display.lcd_display_buffer([2,3,4,5,6,7,6,5,2,3,4,5,6,7,6,5,2,3,4,5], 2)
-    sleep(.05)                                              
-    display.lcd_display_buffer([3,4,5,6,7,6,5,4,3,4,5,6,7,6,5,4,3,4,5,6], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([4,5,6,7,6,5,4,3,4,5,6,7,6,5,4,3,4,5,6,7], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([5,6,7,6,5,4,3,2,5,6,7,6,5,4,3,2,5,6,7,6], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([6,7,6,5,4,3,2,1,6,7,6,5,4,3,2,1,6,7,6,5], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([7,6,5,4,3,2,1,0,7,6,5,4,3,2,1,0,7,6,5,4], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([6,5,4,3,2,1,0,1,6,5,4,3,2,1,0,1,6,5,4,3], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([5,4,3,2,1,0,1,2,5,4,3,2,1,0,1,2,5,4,3,2], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([4,3,2,1,0,1,2,3,4,3,2,1,0,1,2,3,4,3,2,1], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([3,2,1,0,1,2,3,4,3,2,1,0,1,2,3,4,3,2,1,0], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([2,1,0,1,2,3,4,5,2,1,0,1,2,3,4,5,2,1,0,1], 2)
-    sleep(.05)                                 
-    display.lcd_display_buffer([1,0,1,2,3,4,5,6,1,0,1,2,3,4,5,6,1,0,1,2], 2)
\ No newline at end of file
+# Level bars moving on line 2 at 20 frames per second, only the changed cells are sent.
+levels = LCD.compile_animation([
+    [None, [0,1,2,3,4,5,6,7,0,1,2,3,4,5,6,7,0,1,2,3]],
+    [None, [1,2,3,4,5,6,7,6,1,2,3,4,5,6,7,6,1,2,3,4]],
+    [None, [2,3,4,5,6,7,6,5,2,3,4,5,6,7,6,5,2,3,4,5]],
+    [None, [3,4,5,6,7,6,5,4,3,4,5,6,7,6,5,4,3,4,5,6]],
+    [None, [4,5,6,7,6,5,4,3,4,5,6,7,6,5,4,3,4,5,6,7]],
+    [None, [5,6,7,6,5,4,3,2,5,6,7,6,5,4,3,2,5,6,7,6]],
+    [None, [6,7,6,5,4,3,2,1,6,7,6,5,4,3,2,1,6,7,6,5]],
+    [None, [7,6,5,4,3,2,1,0,7,6,5,4,3,2,1,0,7,6,5,4]],
+    [None, [6,5,4,3,2,1,0,1,6,5,4,3,2,1,0,1,6,5,4,3]],
+    [None, [5,4,3,2,1,0,1,2,5,4,3,2,1,0,1,2,5,4,3,2]],
+    [None, [4,3,2,1,0,1,2,3,4,3,2,1,0,1,2,3,4,3,2,1]],
+    [None, [3,2,1,0,1,2,3,4,3,2,1,0,1,2,3,4,3,2,1,0]],
+    [None, [2,1,0,1,2,3,4,5,2,1,0,1,2,3,4,5,2,1,0,1]],
+    [None, [1,0,1,2,3,4,5,6,1,0,1,2,3,4,5,6,1,0,1,2]],
+], fps=20)
+levels.play(display, loops=None)
@@ -0,0 +1,31 @@
+import sys
+from os.path import dirname, join
+
+import pytest
+
+sys.path.insert(0, join(dirname(dirname(__file__)), "src"))
+
+import lcdrw1063 as LCD
+from rw1063emulator import EmulatorBus, RW1063Emulator
+
+
+@pytest.fixture
+def bus():
+    return EmulatorBus()
+
+
+@pytest.fixture
+def emulator(bus):
+    return bus.attach(RW1063Emulator(), LCD.LCD_ADDRESS_3C)
+
+
+@pytest.fixture
+def lcd(bus, emulator):
+    display = LCD.Lcd(addr=LCD.LCD_ADDRESS_3C, transport=bus)
+    yield display
+    display.close()
+
+
+def screen(emulator):
+    """ Returns the emulated panel as text rows with the trailing spaces removed. """
+    return [line.rstrip() for line in emulator.screen()]
@@ -0,0 +1,22 @@
+import lcdrw1063 as LCD
+from i2ccapture import RecordingTransport, Capture, replay
+from rw1063emulator import EmulatorBus, RW1063Emulator
+from conftest import screen
+
+
+def test_replay_reproduces_a_recorded_session(tmp_path, bus, emulator):
+    path = str(tmp_path / "session.cap")
+    recorder = RecordingTransport(path, transport=bus)
+    lcd = LCD.Lcd(addr=LCD.LCD_ADDRESS_3C, transport=recorder)
+    lcd.lcd_display_string("Hello world", 1)
+    lcd.lcd_recover()
+    lcd.lcd_display_string("again", 2)
+    recorder.release()
+
+    target = EmulatorBus()
+    replayed = target.attach(RW1063Emulator())
+    with Capture(path) as capture:
+        assert capture.stats()["transactions"] == bus.transactions
+        assert replay(capture, target, None) == bus.transactions
+    assert screen(replayed) == screen(emulator)
+    assert replayed.busy_violations == 0
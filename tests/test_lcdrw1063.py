@@ -0,0 +1,264 @@
+import asyncio
+import time
+
+import pytest
+
+import lcdrw1063 as LCD
+from rw1063emulator import RW1063Emulator
+from conftest import screen
+
+
+def test_flush_sends_only_changed_cells(bus, emulator, lcd):
+    lcd.lcd_frame_string("Hello world", 1)
+    lcd.lcd_flush()
+    bus.reset_stats()
+    writes = emulator.data_writes
+    lcd.lcd_frame_string("J", 1)
+    lcd.lcd_flush()
+    assert screen(emulator)[0] == "Jello world"
+    assert bus.transactions == 1
+    assert emulator.data_writes - writes == 1
+
+
+def test_flush_merges_runs_adjacent_in_ddram(bus, emulator, lcd):
+    # The end of line 1 and the start of line 3 follow each other in DDRAM.
+    lcd.lcd_frame_string("x", 1, 19)
+    lcd.lcd_frame_string("y", 3, 0)
+    instructions = emulator.instructions
+    lcd.lcd_flush()
+    assert screen(emulator)[0].endswith("x") and screen(emulator)[2] == "y"
+    assert emulator.instructions - instructions == 1
+
+
+def test_full_redraw_is_one_transfer(bus, emulator, lcd):
+    bus.reset_stats()
+    for line in range(1, 5):
+        lcd.lcd_frame_string(str(line) * 20, line)
+    lcd.lcd_flush()
+    assert screen(emulator) == [str(line) * 20 for line in range(1, 5)]
+    assert bus.transactions == 1
+    assert emulator.busy_violations == 0
+
+
+def test_flush_without_changes_sends_nothing(bus, lcd):
+    bus.reset_stats()
+    assert lcd.lcd_flush()
+    assert bus.transactions == 0
+
+
+def test_batch_chains_instructions_and_data(bus, emulator, lcd):
+    bus.reset_stats()
+    with lcd.lcd_batch():
+        lcd.lcd_write_custom_characters(0, [LCD.compile_glyph(["11111"] * 8)])
+        lcd.lcd_write_at(2, 3, b"\x00ok")
+    assert bus.transactions == 1
+    assert bytes(emulator.cgram[:8]) == b"\x1f" * 8
+    assert emulator.screen()[1].startswith("   0ok")
+
+
+def test_clear_display_blanks_the_frame(emulator, lcd):
+    lcd.lcd_frame_string("- Display Line 1", 1)
+    lcd.lcd_flush()
+    lcd.lcd_frame_string("pending", 2)
+    lcd.lcd_clear_display()
+    lcd.lcd_flush()
+    assert screen(emulator) == [""] * 4
+
+
+def test_write_at_clips_off_screen_cells(emulator, lcd):
+    lcd.lcd_write_at(1, -2, "abcd")
+    lcd.lcd_write_at(2, 18, "xyz")
+    lcd.lcd_write_at(5, 0, "missing")
+    assert screen(emulator)[:2] == ["cd", " " * 18 + "xy"]
+
+
+def test_recovery_restores_the_controller_after_power_loss(bus, emulator, lcd):
+    lcd.lcd_display_string("Hello world", 1)
+    lcd.lcd_frame_string("pending", 2)
+    fresh = RW1063Emulator()
+    bus.detach()
+    sleep = lcd.i2c.scheduler.sleep
+
+    def power_back(seconds):
+        bus.attach(fresh)
+        sleep(seconds)
+
+    lcd.i2c.scheduler.sleep = power_back
+    lcd.lcd_display_string("Again", 3)
+    lcd.lcd_flush()
+    assert lcd.recoveries == 1
+    assert screen(fresh) == ["Hello world", "pending", "Again", ""]
+
+
+def test_recovery_gives_up_after_the_last_attempt(bus, lcd):
+    lcd.recovery_attempts = 2
+    bus.detach()
+    with pytest.raises(OSError):
+        lcd.lcd_display_string("lost", 1)
+
+
+def test_renderer_draws_the_latest_frame(emulator, lcd):
+    with LCD.LcdRenderer(lcd, maxFps=1000) as renderer:
+        renderer.lcd_display_string("first", 1)
+        renderer.lcd_display_string("second", 1)
+        assert renderer.flush(timeout=5)
+        assert screen(emulator)[0] == "second"
+
+
+def test_display_manager_drives_panels_on_free_addresses(bus):
+    first = bus.attach(RW1063Emulator(), LCD.LCD_ADDRESS_3C)
+    second = bus.attach(RW1063Emulator(), LCD.LCD_ADDRESS_3D)
+    with LCD.DisplayManager(maxFps=1000) as manager:
+        manager.add_panel("a", transport=bus)
+        manager.add_panel("b", transport=bus)
+        with manager.transaction():
+            manager.lcd_display_string("a", "panel a", 1)
+            manager.lcd_display_string("b", "panel b", 1)
+        assert manager.flush(timeout=5)
+    assert screen(first)[0] == "panel a" and screen(second)[0] == "panel b"
+
+
+def test_glyph_bank_reloads_a_character_overwritten_by_another_writer(emulator, lcd):
+    lcd.glyphs.register("full", ["11111"] * 8)
+    code = lcd.glyphs.code("full")
+    lcd.lcd_write_custom_characters(code, [bytes(8)])
+    assert lcd.glyphs.code("full") == code
+    assert bytes(emulator.cgram[code * 8:code * 8 + 8]) == b"\x1f" * 8
+
+
+def test_animation_plays_every_frame_on_time(emulator, lcd):
+    animation = LCD.compile_animation([["frame 1"], ["frame 2"], ["frame 3"]], fps=10)
+    assert animation.play(lcd) == 0
+    assert screen(emulator)[0] == "frame 3"
+    assert LCD.Animation(bytes(animation)).data == animation.data
+
+
+def _slow_flush(lcd, seconds):
+    """ Makes every flush of lcd take seconds longer, like a slow bus. """
+    flush = lcd.lcd_flush
+
+    def lcd_flush(*args, **kwargs):
+        time.sleep(seconds)
+        return flush(*args, **kwargs)
+
+    lcd.lcd_flush = lcd_flush
+
+
+def test_renderer_survives_a_timed_out_flush_async(emulator, lcd):
+    _slow_flush(lcd, 0.05)
+    with LCD.LcdRenderer(lcd, maxFps=1000) as renderer:
+        renderer.lcd_display_string("first", 1)
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(renderer.flush_async(), 0.01))
+        assert not renderer.waiters
+        renderer.lcd_display_string("second", 1)
+        assert renderer.flush(timeout=5)
+        assert renderer.thread.is_alive()
+    assert screen(emulator)[0] == "second"
+
+
+def test_renderer_survives_a_waiter_on_a_closed_loop(emulator, lcd):
+    loop = asyncio.new_event_loop()
+    future = loop.create_future()
+    loop.close()
+    with LCD.LcdRenderer(lcd, maxFps=1000) as renderer:
+        with renderer.condition:
+            renderer.waiters.append((renderer.generation + 1, loop, future))
+        renderer.lcd_display_string("first", 1)
+        assert renderer.flush(timeout=5)
+        renderer.lcd_display_string("second", 1)
+        assert renderer.flush(timeout=5)
+        assert renderer.thread.is_alive()
+    assert screen(emulator)[0] == "second"
+
+
+def test_cursor_shift_in_cgram_does_not_skip_the_next_address_set(emulator, lcd):
+    glyph = LCD.compile_glyph(["10101"] * 8)
+    lcd.lcd_set_cgram_address(0)
+    lcd.lcd_cursor_display_shift(LCD.LCD_SHIFT_CURSOR | LCD.LCD_SHIFT_RIGHT)
+    lcd.lcd_write_custom_characters(0, [glyph])
+    assert bytes(emulator.cgram[:8]) == glyph
+    assert lcd.custom_character(0) == glyph
+
+
+def test_animation_frames_can_be_tuples_of_rows(emulator, lcd):
+    glyph = ["11111"] * 8
+    animation = LCD.compile_animation([("ab", "cd"), ([b"\x00"], {0: glyph})], fps=10)
+    animation.play(lcd)
+    assert screen(emulator)[:2] == ["0", "cd"]
+    assert lcd.custom_character(0) == LCD.compile_glyph(glyph)
+
+
+def test_widgets_never_take_a_character_still_on_the_display(emulator, lcd):
+    from lcdwidgets import HorizontalBar, Sparkline
+    bar = HorizontalBar(lcd, line=1, width=20)
+    history = Sparkline(lcd, line=2, height=3)
+    bar.render(12)
+    history.push(*range(0, 100, 5))
+    lcd.lcd_flush()
+    drawn = bytes(emulator.cgram)
+    with pytest.raises(ValueError):
+        bar.render(13)
+    lcd.lcd_flush()
+    # Every custom character on the screen still shows the glyph its widget drew.
+    shown = {code for line in emulator.screen_codes() for code in line if code < LCD.LCD_CGRAM_CHARACTERS}
+    assert len(shown) == LCD.LCD_CGRAM_CHARACTERS
+    for code in shown:
+        assert emulator.cgram[code * 8:code * 8 + 8] == drawn[code * 8:code * 8 + 8]
+
+
+def test_dashboard_bars_share_their_glyphs(emulator, lcd):
+    from lcdwidgets import HorizontalBar
+    bars = [HorizontalBar(lcd, line=line, column=4, width=16) for line in range(1, 5)]
+    for value in range(0, 101, 7):
+        for offset, bar in enumerate(bars):
+            bar.render((value + 13 * offset) % 101)
+        lcd.lcd_flush()
+    assert len(lcd.glyphs.loaded) == 4
+
+
+def test_failed_flush_keeps_the_cells_pending(bus, emulator, lcd):
+    lcd.recovery_attempts = 0
+    lcd.lcd_frame_string("hello", 1)
+    lcd.lcd_flush()
+    lcd.glyphs.register("full", ["11111"] * 8)
+    bus.detach()
+    with pytest.raises(OSError):
+        with lcd.lcd_batch():
+            lcd.lcd_frame_string("world", 2)
+            lcd.lcd_frame_buffer(bytes([lcd.glyphs.code("full")]), 3)
+            lcd.lcd_flush()
+    bus.attach(emulator, LCD.LCD_ADDRESS_3C)
+    assert lcd.custom_character(0) is None
+    lcd.lcd_frame_buffer(bytes([lcd.glyphs.code("full")]), 3)
+    lcd.lcd_flush()
+    assert screen(emulator)[:3] == ["hello", "world", "0"]
+    assert bytes(emulator.cgram[:8]) == b"\x1f" * 8
+
+
+def test_failed_recovery_keeps_the_cells_pending(bus, emulator, lcd):
+    lcd.recovery_attempts = 2
+    lcd.lcd_frame_string("hello", 1)
+    lcd.lcd_flush()
+    bus.detach()
+    lcd.lcd_frame_string("world", 2)
+    with pytest.raises(OSError):
+        lcd.lcd_flush()
+    bus.attach(emulator, LCD.LCD_ADDRESS_3C)
+    lcd.lcd_flush()
+    assert screen(emulator)[:2] == ["hello", "world"]
+
+
+def test_metrics_charge_batched_writes_to_the_method_queueing_them(bus, emulator):
+    metrics = LCD.Metrics()
+    lcd = LCD.Lcd(addr=LCD.LCD_ADDRESS_3C, transport=bus, metrics=metrics)
+    metrics.methods.clear()
+    with lcd.lcd_batch():
+        lcd.lcd_write_custom_characters(0, [LCD.compile_glyph(["11111"] * 8)])
+        lcd.lcd_write_at(2, 3, "ok")
+    methods = metrics.snapshot()["methods"]
+    assert methods["lcd_write_custom_characters"]["bytes"] == 2 + 1 + 8
+    assert methods["lcd_write_at"]["bytes"] == 2 + 1 + 2
+    assert methods["lcd_commit"]["bytes"] == 0
+    assert sum(counters["transactions"] for counters in methods.values()) == 1
+    lcd.close()
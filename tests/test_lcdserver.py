@@ -0,0 +1,31 @@
+from threading import Thread
+
+import pytest
+
+from lcdserver import LcdServer, LcdClient
+from conftest import screen
+
+
+@pytest.fixture
+def server(tmp_path, lcd):
+    server = LcdServer(lcd, str(tmp_path / "lcd.sock"))
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.running = False
+    thread.join()
+    server.close()
+
+
+def test_clients_draw_in_their_claimed_regions(server, emulator):
+    with LcdClient(server.path) as left, LcdClient(server.path) as right:
+        left.claim(1, 0, 10)
+        right.claim(1, 10, 10)
+        with pytest.raises(ValueError):
+            right.claim(1, 5, 10)
+        left.lcd_frame_string("left", 1)
+        right.lcd_frame_string("right", 1, 10)
+        with pytest.raises(ValueError):
+            left.lcd_frame_string("outside", 2)
+        right.lcd_flush()
+    assert screen(emulator)[0] == "left      right"